@@ -13,6 +13,8 @@ import requests
 from typing import Dict, Optional
 from config import Config
 from utils.logger import request_logger, logger
+from utils import tracing
+from utils.metrics import hikcentral_errors
 
 
 class HikCentralAPI:
@@ -170,13 +172,14 @@ class HikCentralAPI:
         status_code = 500
         
         try:
-            response = requests.post(
-                url,
-                headers=headers,
-                data=body_str,
-                verify=self.verify_ssl,
-                timeout=30
-            )
+            with tracing.span('hikcentral.request', endpoint=endpoint):
+                response = requests.post(
+                    url,
+                    headers=headers,
+                    data=body_str,
+                    verify=self.verify_ssl,
+                    timeout=30
+                )
             
             status_code = response.status_code
             response_body = response.json() if response.text else None
@@ -185,6 +188,7 @@ class HikCentralAPI:
             if response_body and response_body.get('code') != '0':
                 error = f"HikCentral error: {response_body.get('msg', 'Unknown error')}"
                 logger.error(error)
+                hikcentral_errors.inc(code=response_body.get('code'))
                 return None
             
             response.raise_for_status()
@@ -199,6 +203,9 @@ class HikCentralAPI:
                     response_body = e.response.json()
                 except:
                     response_body = e.response.text
+                hikcentral_errors.inc(code=f"http_{status_code}")
+            else:
+                hikcentral_errors.inc(code='network')
             logger.error(f"HikCentral API error: {error}")
             return None
         
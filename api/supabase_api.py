@@ -5,7 +5,9 @@ import time
 import requests
 from typing import Dict, List, Optional
 from config import Config
+from utils.image_cache import image_cache
 from utils.logger import request_logger, logger
+from utils import tracing
 
 
 class SupabaseAPI:
@@ -60,12 +62,13 @@ class SupabaseAPI:
         status_code = 500
         
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=headers, params=params, timeout=30)
-            elif method == 'POST':
-                response = requests.post(url, headers=headers, json=data, params=params, timeout=30)
-            else:
-                raise ValueError(f"Unsupported method: {method}")
+            with tracing.span('supabase.request', endpoint=endpoint, method=method):
+                if method == 'GET':
+                    response = requests.get(url, headers=headers, params=params, timeout=30)
+                elif method == 'POST':
+                    response = requests.post(url, headers=headers, json=data, params=params, timeout=30)
+                else:
+                    raise ValueError(f"Unsupported method: {method}")
             
             status_code = response.status_code
             response_body = response.json() if response.text else None
@@ -187,36 +190,59 @@ class SupabaseAPI:
             logger.error(f"Failed to update worker status")
             return False
     
-    def download_image(self, url: str, save_path: str) -> bool:
+    def fetch_image(self, url: str) -> Optional[bytes]:
         """
-        Download image from URL
+        Download image from URL into memory
+        
+        With the image cache enabled, a URL downloaded before is requested
+        conditionally (If-None-Match / If-Modified-Since) and served from the
+        cache on 304 Not Modified.
         
         Args:
             url: Image URL
-            save_path: Local path to save image
         
         Returns:
-            True if download successful, False otherwise
+            Image bytes, or None if the download failed
         """
         start_time = time.time()
         error = None
         status_code = 500
+        content = None
+        headers = image_cache.conditional_headers(url) if Config.IMAGE_CACHE_ENABLED else {}
         
         try:
-            response = requests.get(url, timeout=30)
+            with tracing.span('supabase.fetch_image', conditional=bool(headers)):
+                response = requests.get(url, headers=headers, timeout=30)
             status_code = response.status_code
-            response.raise_for_status()
             
-            with open(save_path, 'wb') as f:
-                f.write(response.content)
+            if status_code == 304 and headers:
+                content = image_cache.get_url(url)
+                if content is not None:
+                    logger.info(f"Image not modified, using cached copy: {url}")
+                    # A successful revalidation: log it as a success, not as a non-2xx failure
+                    status_code = 200
+                    return content
+                # Cache entry vanished meanwhile; download unconditionally
+                with tracing.span('supabase.fetch_image', conditional=False):
+                    response = requests.get(url, timeout=30)
+                status_code = response.status_code
             
-            logger.info(f"Downloaded image to {save_path}")
-            return True
+            response.raise_for_status()
+            
+            content = response.content
+            if Config.IMAGE_CACHE_ENABLED:
+                image_cache.put_url(
+                    url,
+                    content,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified')
+                )
+            return content
         
         except Exception as e:
             error = str(e)
             logger.error(f"Failed to download image: {error}")
-            return False
+            return None
         
         finally:
             end_time = time.time()
@@ -227,11 +253,37 @@ class SupabaseAPI:
                     api_target='supabase',
                     endpoint=url,
                     method='GET',
-                    headers={},
+                    headers=headers,
                     body=None,
                     start_time=start_time,
                     end_time=end_time,
                     status_code=status_code,
-                    response_body=f"Image download to {save_path}",
+                    response_body=f"Image download ({len(content) if content else 0} bytes)",
                     error=error
-                )
\ No newline at end of file
+                )
+    
+    def download_image(self, url: str, save_path: str) -> bool:
+        """
+        Download image from URL
+        
+        Args:
+            url: Image URL
+            save_path: Local path to save image
+        
+        Returns:
+            True if download successful, False otherwise
+        """
+        content = self.fetch_image(url)
+        if content is None:
+            return False
+        
+        try:
+            with open(save_path, 'wb') as f:
+                f.write(content)
+            
+            logger.info(f"Downloaded image to {save_path}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Failed to save downloaded image: {e}")
+            return False
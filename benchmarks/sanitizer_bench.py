@@ -0,0 +1,134 @@
+"""
+Microbenchmark: request log sanitization of an add_person call
+
+Compares the previous four-pass sanitizer (sanitize_body + redact_base64_images
+on body and response, uncompiled re.sub per pattern, every key lowercased
+against every sensitive key) with DataSanitizer.sanitize_payload.
+    
+    python benchmarks/sanitizer_bench.py [face.jpg] [--rounds N]
+
+Without an image, ~300 KB of random bytes stand in for the JPEG (its base64
+has the same alphabet and digit runs as a real photo's).
+"""
+import argparse
+import base64
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.sanitizer import DataSanitizer  # noqa: E402
+
+
+class LegacySanitizer:
+    """The sanitizer as it was before the single-pass engine"""
+    
+    SENSITIVE_KEYS = DataSanitizer.SENSITIVE_KEYS
+    SENSITIVE_PATTERNS = [
+        (r'\d{10}', '***IDNUM***'),
+        (r'\d{14}', '***IDNUM***'),
+        (r'05\d{8}', '***PHONE***'),
+        (r'\+9665\d{8}', '***PHONE***'),
+    ]
+    
+    @classmethod
+    def sanitize(cls, data, depth=0):
+        if depth > 10:
+            return '[MAX_DEPTH_REACHED]'
+        if isinstance(data, dict):
+            sanitized = {}
+            for key, value in data.items():
+                if any(sensitive.lower() in key.lower() for sensitive in cls.SENSITIVE_KEYS):
+                    sanitized[key] = '***REDACTED***'
+                else:
+                    sanitized[key] = cls.sanitize(value, depth + 1)
+            return sanitized
+        elif isinstance(data, list):
+            return [cls.sanitize(item, depth + 1) for item in data]
+        elif isinstance(data, str):
+            for pattern, replacement in cls.SENSITIVE_PATTERNS:
+                data = re.sub(pattern, replacement, data)
+            return data
+        return data
+    
+    @classmethod
+    def redact_base64_images(cls, data):
+        if isinstance(data, dict):
+            result = {}
+            for key, value in data.items():
+                if key in ['faceData', 'imageData', 'cardImage'] and isinstance(value, str):
+                    result[key] = f'[BASE64_IMAGE_{len(value)}_BYTES]' if len(value) > 100 else value
+                elif isinstance(value, (dict, list)):
+                    result[key] = cls.redact_base64_images(value)
+                else:
+                    result[key] = value
+            return result
+        elif isinstance(data, list):
+            return [cls.redact_base64_images(item) for item in data]
+        return data
+
+
+def add_person_call(image: bytes):
+    """Body and response of HikCentralAPI.add_person"""
+    body = {
+        'personCode': '29801011234567',
+        'personFamilyName': 'Abdelrahman',
+        'personGivenName': 'Mohamed',
+        'gender': 1,
+        'orgIndexCode': '1',
+        'phoneNo': '0512345678',
+        'email': 'worker@example.com',
+        'faces': [{'faceData': base64.b64encode(image).decode('utf-8')}],
+        'fingerPrint': [],
+        'cards': [],
+        'beginTime': '2026-10-16T00:00:00+03:00',
+        'endTime': '2027-10-16T23:59:59+03:00',
+        'residentRoomNo': 1,
+        'residentFloorNo': 1
+    }
+    response = {'code': '0', 'msg': 'Success', 'data': {'personId': '4521'}}
+    return body, response
+
+
+def legacy(body, response):
+    return (
+        LegacySanitizer.redact_base64_images(LegacySanitizer.sanitize(body)),
+        LegacySanitizer.redact_base64_images(LegacySanitizer.sanitize(response))
+    )
+
+
+def single_pass(body, response):
+    return DataSanitizer.sanitize_payload(body), DataSanitizer.sanitize_payload(response)
+
+
+def bench(fn, args, rounds):
+    fn(*args)  # warm up (regex cache, key memo)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(*args)
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('image', nargs='?', help='Face image to embed (default: 300 KB of random bytes)')
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+    
+    image = Path(args.image).read_bytes() if args.image else os.urandom(300 * 1024)
+    body, response = add_person_call(image)
+    print(f"add_person payload: faceData {len(body['faces'][0]['faceData']) / 1024:.0f} KB base64")
+    
+    legacy_ms = bench(legacy, (body, response), args.rounds)
+    single_ms = bench(single_pass, (body, response), args.rounds)
+    print(f"four-pass sanitizer:   {legacy_ms:8.3f} ms/call")
+    print(f"single-pass sanitizer: {single_ms:8.3f} ms/call")
+    print(f"speedup:               {legacy_ms / single_ms:8.1f}x")
+    print(f"result: {single_pass(body, response)[0]}")
+
+
+if __name__ == '__main__':
+    main()
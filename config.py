@@ -27,21 +27,111 @@ class Config:
     DASHBOARD_PASSWORD = '123456'
     DASHBOARD_SESSION_TIMEOUT = 1800
     DASHBOARD_LOG_RETENTION_DAYS = 30
+    # Serve the dashboard from a thread of main.py; set False when it runs in
+    # its own processes instead (e.g. gunicorn -w 4 wsgi:app)
+    DASHBOARD_IN_PROCESS = True
     
     # Logging Configuration
     LOG_API_REQUESTS = True
     MAX_REQUEST_LOGS = 10000
+    REQUEST_LOG_SEGMENT_MINUTES = 60
+    
+    # Request logs are sanitized and written by a background thread in batches.
+    # When its queue is full, new logs are dropped ('drop'), failed requests plus
+    # 1 in REQUEST_LOG_OVERFLOW_SAMPLE_RATE successes (none if 0) wait for room
+    # ('sample'), or every log waits ('block'), for at most REQUEST_LOG_BLOCK_SECONDS.
+    REQUEST_LOG_ASYNC = True
+    REQUEST_LOG_QUEUE_SIZE = 5000
+    REQUEST_LOG_BATCH_SIZE = 200
+    REQUEST_LOG_FLUSH_SECONDS = 1.0
+    REQUEST_LOG_OVERFLOW_POLICY = 'sample'
+    REQUEST_LOG_OVERFLOW_SAMPLE_RATE = 10
+    REQUEST_LOG_BLOCK_SECONDS = 2.0
+    
+    # What a request log keeps: 'full' = headers and bodies of every request;
+    # 'tiered' = bodies only for failures, calls slower than REQUEST_LOG_SLOW_MS
+    # and responses carrying events, metadata (target, endpoint, status,
+    # duration) for other successes, of which only 1 in
+    # REQUEST_LOG_SUCCESS_SAMPLE_RATE is stored (all are counted in the stats).
+    # Stored headers/bodies are capped at REQUEST_LOG_MAX_FIELD_BYTES each.
+    REQUEST_LOG_CAPTURE = 'tiered'
+    REQUEST_LOG_SLOW_MS = 3000
+    REQUEST_LOG_SUCCESS_SAMPLE_RATE = 10
+    REQUEST_LOG_MAX_FIELD_BYTES = 16384
+    
+    # Segments older than DASHBOARD_LOG_RETENTION_DAYS (or trimmed beyond
+    # MAX_REQUEST_LOGS) are compressed into daily archives ('gzip' or 'lzma')
+    # kept for REQUEST_LOG_ARCHIVE_DAYS (0 = forever), instead of being deleted
+    REQUEST_LOG_ARCHIVE_ENABLED = True
+    REQUEST_LOG_ARCHIVE_COMPRESSION = 'gzip'
+    REQUEST_LOG_ARCHIVE_DAYS = 365
+    
+    # Stage timings of processed events (download, encoding, duplicate scan,
+    # HikCentral and Supabase calls...), the last TRACE_BUFFER_SIZE events
+    # kept in memory for the dashboard
+    TRACE_ENABLED = True
+    TRACE_BUFFER_SIZE = 200
+    
+    # On-demand profiling of sync cycles, armed from the dashboard: cProfile
+    # stats plus stacks sampled every PROFILE_SAMPLE_INTERVAL seconds
+    # (collapsed for flamegraphs); the newest PROFILE_KEEP profiles are kept
+    PROFILE_MAX_CYCLES = 10
+    PROFILE_SAMPLE_INTERVAL = 0.005
+    PROFILE_KEEP = 50
     
     # System Configuration
     SYNC_INTERVAL_SECONDS = 60
     DATA_DIR = Path('./data')
     FACE_SIMILARITY_THRESHOLD = 0.4
     
+    # Face duplicate search index (IVF). Below FACE_INDEX_MIN_SIZE known
+    # faces an exact scan is used. FACE_INDEX_NPROBE is the recall/latency
+    # knob: more cells scanned per lookup means better recall but slower.
+    FACE_INDEX_ENABLED = True
+    FACE_INDEX_MIN_SIZE = 20000
+    FACE_INDEX_NLIST = 0  # 0 = about sqrt(number of faces)
+    FACE_INDEX_NPROBE = 16
+    
+    # Longest side face images are downscaled to before detection (0 = keep full size)
+    FACE_IMAGE_MAX_SIDE = 1024
+    
+    # Processes used to encode faces of bulk worker events (0 = one per CPU core)
+    FACE_ENCODING_PROCESSES = 0
+    
+    # Keep downloaded images in memory for encoding and upload, writing the
+    # files in the background (False = download to disk and re-read)
+    FACE_PIPELINE_IN_MEMORY = True
+    
+    # Cache downloaded images by content hash and revalidate repeat downloads.
+    # The daily cleanup drops images unused for IMAGE_CACHE_MAX_AGE_DAYS, then
+    # the least recently used ones until the cache fits IMAGE_CACHE_MAX_MB
+    # (0 = no limit).
+    IMAGE_CACHE_ENABLED = True
+    IMAGE_CACHE_MAX_AGE_DAYS = 90
+    IMAGE_CACHE_MAX_MB = 1024
+    
+    # Workers storage: 'json' or 'sqlite' (indexed). Switching to 'sqlite'
+    # imports workers.json into workers.db once, on the first start.
+    WORKERS_DB_BACKEND = 'json'
+    
     # Data directories
     FACES_DIR = DATA_DIR / 'faces'
     ID_CARDS_DIR = DATA_DIR / 'id_cards'
     WORKERS_DB = DATA_DIR / 'workers.json'
-    REQUEST_LOGS_DB = DATA_DIR / 'request_logs.json'
+    WORKERS_SQLITE_DB = DATA_DIR / 'workers.db'
+    REQUEST_LOGS_DB = DATA_DIR / 'request_logs.json'  # legacy, imported once into REQUEST_LOGS_DIR
+    REQUEST_LOGS_DIR = DATA_DIR / 'request_logs'
+    REQUEST_STATS_PATH = DATA_DIR / 'request_stats.json'
+    REQUEST_LOG_ARCHIVE_DIR = DATA_DIR / 'request_log_archive'
+    METRICS_SNAPSHOT_PATH = DATA_DIR / 'metrics.prom'
+    TRACES_SNAPSHOT_PATH = DATA_DIR / 'traces.json'
+    PROFILES_DIR = DATA_DIR / 'profiles'
+    PROFILE_ARM_PATH = DATA_DIR / 'profile_arm.json'
+    FACE_ENCODINGS_PATH = DATA_DIR / 'face_encodings.bin'
+    FACE_INDEX_PATH = DATA_DIR / 'face_index.npz'
+    REINDEX_CHECKPOINT = DATA_DIR / 'reindex_checkpoint.json'
+    IMAGE_CACHE_DIR = DATA_DIR / 'image_cache'
+    IMAGE_CACHE_INDEX = DATA_DIR / 'image_cache.json'
     
     # Secret key for Flask sessions
     SECRET_KEY = 'hydepark-dashboard-secret-key-2025'
@@ -52,13 +142,11 @@ class Config:
         cls.DATA_DIR.mkdir(exist_ok=True)
         cls.FACES_DIR.mkdir(exist_ok=True)
         cls.ID_CARDS_DIR.mkdir(exist_ok=True)
+        cls.REQUEST_LOGS_DIR.mkdir(exist_ok=True)
         
         # Create database files if they don't exist
         if not cls.WORKERS_DB.exists():
             cls.WORKERS_DB.write_text('[]')
-        
-        if not cls.REQUEST_LOGS_DB.exists():
-            cls.REQUEST_LOGS_DB.write_text('[]')
     
     @classmethod
     def validate(cls):
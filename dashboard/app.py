@@ -1,25 +1,30 @@
 """
 Dashboard web application
 """
-import os
 import json
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_file
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Response, abort, render_template, request, redirect, url_for, session, jsonify, send_from_directory
 import csv
-from io import StringIO, BytesIO
+from io import StringIO
+from urllib.parse import urlencode
 from config import Config
-from database import WorkersDatabase, RequestLogsDatabase
+from database import RequestStats, open_workers_database
 from dashboard.auth import login_required, check_credentials
 from utils.logger import request_logger
+from utils import metrics, profiler, tracing
 
 app = Flask(__name__)
 app.secret_key = Config.SECRET_KEY
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(seconds=Config.DASHBOARD_SESSION_TIMEOUT)
 
 # Database instances
-workers_db = WorkersDatabase()
-logs_db = RequestLogsDatabase()
+workers_db = open_workers_database()
+
+# Worker fields shown in the workers list
+WORKER_LIST_FIELDS = [
+    'nationalIdNumber', 'fullName', 'phoneNumber', 'status',
+    'hikcentral_person_id', 'has_privilege_access', 'created_at'
+]
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -74,19 +79,15 @@ def dashboard():
                 log['event_types'] = [e.get('type') for e in events]
                 important_logs.append(log)
     
-    # Get worker counts
-    all_workers = workers_db.get_all_workers()
-    approved_workers = len([w for w in all_workers if w.get('status') == 'approved'])
-    blocked_workers = len([w for w in all_workers if w.get('status') == 'blocked'])
-    
     return render_template(
         'dashboard.html',
         stats=stats,
+        endpoint_stats=request_logger.get_endpoint_stats()[:10],
         recent_logs=recent_logs[:10],  # Show last 10 for recent activity
         important_logs=important_logs[:5],  # Show last 5 important events
-        total_workers=len(all_workers),
-        approved_workers=approved_workers,
-        blocked_workers=blocked_workers
+        total_workers=workers_db.count(),
+        approved_workers=workers_db.count({'status': 'approved'}),
+        blocked_workers=workers_db.count({'status': 'blocked'})
     )
 
 
@@ -101,6 +102,7 @@ def logs():
     end_date = request.args.get('end_date', '')
     endpoint = request.args.get('endpoint', '')
     limit = int(request.args.get('limit', 100))
+    page = max(int(request.args.get('page', 1)), 1)
     
     # Build filters
     filters = {}
@@ -115,12 +117,20 @@ def logs():
     if endpoint:
         filters['endpoint'] = endpoint
     
-    # Get logs
-    logs = request_logger.get_recent_logs(limit=limit, filters=filters)
+    # Get one page of logs (plus one row to know whether there is a next page)
+    logs = request_logger.get_recent_logs(limit=limit + 1, filters=filters, offset=(page - 1) * limit)
+    has_next = len(logs) > limit
+    
+    def page_url(number):
+        # Same filters, other page ('endpoint' can't be passed to url_for as a keyword)
+        return f"{url_for('logs')}?{urlencode({**request.args, 'page': number})}"
     
     return render_template(
         'logs.html',
-        logs=logs,
+        logs=logs[:limit],
+        page=page,
+        has_next=has_next,
+        page_url=page_url,
         filters={
             'api_target': api_target,
             'success': success,
@@ -138,8 +148,10 @@ def api_logs():
     """API endpoint for fetching logs (AJAX)"""
     # Get parameters
     limit = int(request.args.get('limit', 100))
+    offset = int(request.args.get('offset', 0))
     api_target = request.args.get('api_target', '')
     success = request.args.get('success', '')
+    fields = request.args.get('fields', '')
     
     # Build filters
     filters = {}
@@ -148,8 +160,13 @@ def api_logs():
     if success:
         filters['success'] = success == 'true'
     
-    # Get logs
-    logs = request_logger.get_recent_logs(limit=limit, filters=filters)
+    # Get logs (optionally only some fields, e.g. fields=timestamp,endpoint,status_code)
+    logs = request_logger.get_recent_logs(
+        limit=limit,
+        filters=filters,
+        offset=offset,
+        fields=fields.split(',') if fields else None
+    )
     
     return jsonify(logs)
 
@@ -161,82 +178,223 @@ def api_stats():
     stats = request_logger.get_stats()
     
     # Get worker counts
-    all_workers = workers_db.get_all_workers()
-    approved_workers = len([w for w in all_workers if w.get('status') == 'approved'])
-    blocked_workers = len([w for w in all_workers if w.get('status') == 'blocked'])
-    
-    stats['total_workers'] = len(all_workers)
-    stats['approved_workers'] = approved_workers
-    stats['blocked_workers'] = blocked_workers
+    stats['total_workers'] = workers_db.count()
+    stats['approved_workers'] = workers_db.count({'status': 'approved'})
+    stats['blocked_workers'] = workers_db.count({'status': 'blocked'})
+    stats['endpoints'] = request_logger.get_endpoint_stats()
     
     return jsonify(stats)
 
 
+@app.route('/api/stats/timeline')
+@login_required
+def api_stats_timeline():
+    """API endpoint for per-minute or per-hour request statistics"""
+    resolution = request.args.get('resolution', 'minute')
+    limit = int(request.args.get('limit', 60))
+    
+    return jsonify(request_logger.get_stats_timeline(resolution, limit))
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Metrics in the Prometheus text format (for scraping, no login)
+    
+    Request counters and latency histograms come from the shared request
+    stats; the sync service's own metrics are live when the dashboard runs
+    in its process, otherwise read from the snapshot it writes every cycle.
+    """
+    request_lines = metrics.request_stats_lines(
+        RequestStats.LATENCY_BUCKETS_MS, request_logger.get_endpoint_histograms()
+    )
+    if Config.DASHBOARD_IN_PROCESS:
+        process_metrics = metrics.registry.render()
+    else:
+        process_metrics = metrics.MetricsRegistry.read_snapshot(Config.METRICS_SNAPSHOT_PATH) or ''
+    
+    return Response(
+        '\n'.join(request_lines) + '\n' + process_metrics,
+        mimetype='text/plain; version=0.0.4'
+    )
+
+
+@app.route('/traces')
+@login_required
+def traces():
+    """Stage timings of recently processed events"""
+    event_type = request.args.get('event_type', '')
+    national_id = request.args.get('national_id', '').strip()
+    limit = int(request.args.get('limit', 50))
+    
+    recent = tracing.recent_traces(limit, event_type or None, national_id or None)
+    
+    return render_template(
+        'traces.html',
+        traces=recent,
+        stages=tracing.stage_breakdown(recent),
+        event_type=event_type,
+        national_id=national_id,
+        limit=limit
+    )
+
+
+@app.route('/api/traces')
+@login_required
+def api_traces():
+    """API endpoint for recent event traces and their per-stage breakdown"""
+    event_type = request.args.get('event_type', '')
+    national_id = request.args.get('national_id', '')
+    limit = int(request.args.get('limit', 50))
+    
+    recent = tracing.recent_traces(limit, event_type or None, national_id or None)
+    return jsonify({'traces': recent, 'stages': tracing.stage_breakdown(recent)})
+
+
+@app.route('/profiles')
+@login_required
+def profiles():
+    """Sync cycle profiles: arm the profiler and download past profiles"""
+    return render_template(
+        'profiles.html',
+        profiles=profiler.list_profiles(),
+        armed=profiler.status(),
+        max_cycles=Config.PROFILE_MAX_CYCLES
+    )
+
+
+@app.route('/profiles/arm', methods=['POST'])
+@login_required
+def arm_profiler():
+    """Profile the next N sync cycles"""
+    try:
+        cycles = int(request.form.get('cycles', 1))
+    except ValueError:
+        cycles = 1
+    profiler.arm(cycles, requested_by=session.get('username', ''))
+    return redirect(url_for('profiles'))
+
+
+@app.route('/profiles/disarm', methods=['POST'])
+@login_required
+def disarm_profiler():
+    """Cancel the cycles still to be profiled"""
+    profiler.disarm()
+    return redirect(url_for('profiles'))
+
+
+@app.route('/profiles/<path:filename>')
+@login_required
+def download_profile(filename):
+    """Download a .pstats or collapsed-stack file"""
+    if not filename.endswith((profiler.PSTATS_SUFFIX, profiler.COLLAPSED_SUFFIX)):
+        abort(404)
+    return send_from_directory(Config.PROFILES_DIR.resolve(), filename, as_attachment=True)
+
+
 @app.route('/workers')
 @login_required
 def workers():
     """Workers management page"""
     status_filter = request.args.get('status', '')
+    cursor = request.args.get('cursor') or None
+    limit = int(request.args.get('limit', 100))
+    query = {'status': status_filter} if status_filter else None
     
-    if status_filter:
-        workers_list = workers_db.get_workers_by_status(status_filter)
-    else:
-        workers_list = workers_db.get_all_workers()
+    # One page of the columns shown (not the face encodings etc.)
+    try:
+        workers_list, next_cursor = workers_db.find_page(
+            query, limit=limit, cursor=cursor, fields=WORKER_LIST_FIELDS
+        )
+    except ValueError:
+        return redirect(url_for('workers', status=status_filter))
     
-    return render_template('workers.html', workers=workers_list, status_filter=status_filter)
+    return render_template(
+        'workers.html',
+        workers=workers_list,
+        status_filter=status_filter,
+        total_workers=workers_db.count(query),
+        next_cursor=next_cursor,
+        limit=limit
+    )
+
+
+LOG_EXPORT_FIELDS = [
+    'timestamp', 'api_target', 'endpoint', 'method', 'status_code',
+    'duration_ms', 'success', 'error'
+]
+
+
+def _export_source():
+    """
+    Logs to export: the hot store, or archived days streamed from disk
+    
+    ?source=archive streams the compressed daily archives (optionally within
+    ?start_date / ?end_date) without loading them into the hot store.
+    """
+    if request.args.get('source') == 'archive':
+        return request_logger.iter_archived_logs(
+            request.args.get('start_date') or None,
+            request.args.get('end_date') or None
+        ), 'archive'
+    return request_logger.get_recent_logs(limit=10000), 'logs'
+
+
+def _export_name(prefix: str, extension: str) -> str:
+    return f'{prefix}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
 
 
 @app.route('/export/logs')
 @login_required
 def export_logs():
-    """Export logs as CSV"""
-    # Get all logs
-    logs = request_logger.get_recent_logs(limit=10000)
-    
-    # Create CSV
-    output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=[
-        'timestamp', 'api_target', 'endpoint', 'method', 'status_code',
-        'duration_ms', 'success', 'error'
-    ])
-    
-    writer.writeheader()
-    for log in logs:
-        writer.writerow({
-            'timestamp': log.get('timestamp', ''),
-            'api_target': log.get('api_target', ''),
-            'endpoint': log.get('endpoint', ''),
-            'method': log.get('method', ''),
-            'status_code': log.get('status_code', ''),
-            'duration_ms': log.get('duration_ms', ''),
-            'success': log.get('success', ''),
-            'error': log.get('error', '')
-        })
-    
-    # Create response
-    output.seek(0)
-    return send_file(
-        BytesIO(output.getvalue().encode('utf-8')),
+    """Export logs as CSV (streamed)"""
+    logs, prefix = _export_source()
+    
+    def generate():
+        output = StringIO()
+        writer = csv.DictWriter(output, fieldnames=LOG_EXPORT_FIELDS)
+        writer.writeheader()
+        for log in logs:
+            writer.writerow({field: log.get(field, '') for field in LOG_EXPORT_FIELDS})
+            if output.tell() > 64 * 1024:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
+    
+    return Response(
+        generate(),
         mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'logs_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+        headers={'Content-Disposition': f'attachment; filename={_export_name(prefix, "csv")}'}
     )
 
 
 @app.route('/export/logs/json')
 @login_required
 def export_logs_json():
-    """Export logs as JSON"""
-    logs = request_logger.get_recent_logs(limit=10000)
+    """Export logs as JSON (streamed)"""
+    logs, prefix = _export_source()
+    
+    def generate():
+        yield '['
+        for i, log in enumerate(logs):
+            yield (',\n' if i else '\n') + json.dumps(log, indent=2)
+        yield '\n]\n'
     
-    return send_file(
-        BytesIO(json.dumps(logs, indent=2).encode('utf-8')),
+    return Response(
+        generate(),
         mimetype='application/json',
-        as_attachment=True,
-        download_name=f'logs_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+        headers={'Content-Disposition': f'attachment; filename={_export_name(prefix, "json")}'}
     )
 
 
+@app.route('/api/logs/archives')
+@login_required
+def api_log_archives():
+    """API endpoint listing archived log days (time range, counts, errors)"""
+    return jsonify(request_logger.get_archives())
+
+
 def run_dashboard(host='0.0.0.0', port=8080):
     """Run the dashboard application"""
     app.run(host=host, port=port, debug=False)
@@ -1,43 +1,293 @@
 """
-Local database operations using JSON files
+Local database operations using JSON files (or SQLite for workers)
 """
+import base64
+import heapq
 import json
+import logging
+import os
+import sqlite3
 import threading
-from datetime import datetime
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from itertools import islice
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import ContextManager, Dict, Iterator, List, Optional, Any, Tuple
+from urllib.parse import urlparse
+import numpy as np
 from config import Config
+from utils.file_lock import FileLock, lock_path
+from utils.log_archive import RequestLogArchive
+from utils.log_index import RequestLogIndex, to_epoch
 
-class Database:
-    """Thread-safe JSON database for local storage"""
+# The application logger (configured in utils.logger, which imports this module)
+logger = logging.getLogger('hydepark-sync')
+
+
+def _parse_sort(sort: Optional[str]) -> Tuple[Optional[str], bool]:
+    """Split a sort spec ('field' or '-field' for descending) into (field, descending)"""
+    if not sort:
+        return None, False
+    if sort.startswith('-'):
+        return sort[1:], True
+    return sort, False
+
+
+def _sort_key(value: Any) -> Tuple:
+    """Ordering of field values, the same as SQLite's: missing < numbers < text < other"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (bool, int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, json.dumps(value, sort_keys=True))
+
+
+def _encode_cursor(value: Any, position: int) -> str:
+    """Opaque page cursor: sort value and position of the last row returned"""
+    return base64.urlsafe_b64encode(json.dumps([value, position]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[Any, int]:
+    """Sort value and position from a page cursor (ValueError if malformed)"""
+    try:
+        value, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return value, int(position)
+
+
+def _project(record: Dict, fields: Optional[List[str]]) -> Dict:
+    """Copy of a record, reduced to fields if given"""
+    if fields is None:
+        return dict(record)
+    return {field: record.get(field) for field in fields}
+
+
+class _Batch:
+    """Working copy of a JSON database during Database.batch()"""
+    
+    def __init__(self):
+        self.data: Optional[List[Dict]] = None
+        self.dirty = False
+
+
+class DocumentDatabase(ABC):
+    """
+    Record store interface shared by the JSON and SQLite databases
+    
+    Records are dicts; queries match field values exactly. Backends
+    implement storage and _find(), on which find_many and find_page
+    (offset and keyset pagination) are built.
+    """
+    
+    @abstractmethod
+    def batch(self) -> ContextManager[None]:
+        """Group many operations into one write (nested batches join the outer one)"""
+    
+    @abstractmethod
+    def read(self) -> List[Dict]:
+        """Read all records from database"""
+    
+    @abstractmethod
+    def write(self, data: List[Dict]) -> bool:
+        """Write all records to database"""
+    
+    @abstractmethod
+    def find_one(self, query: Dict) -> Optional[Dict]:
+        """Find first record matching query"""
+    
+    @abstractmethod
+    def _find(
+        self,
+        query: Optional[Dict],
+        sort: Optional[str],
+        after: Optional[Tuple[Any, int]],
+        max_rows: Optional[int],
+        fields: Optional[List[str]] = None
+    ) -> Iterator[Tuple[Any, int, Dict]]:
+        """Yield (sort value, position, record) for matching records in order"""
+    
+    @abstractmethod
+    def count(self, query: Dict = None) -> int:
+        """Number of records matching query"""
+    
+    @abstractmethod
+    def insert(self, record: Dict) -> Dict:
+        """Insert a new record"""
+    
+    @abstractmethod
+    def update(self, query: Dict, update: Dict) -> int:
+        """Update records matching query"""
+    
+    @abstractmethod
+    def delete(self, query: Dict) -> int:
+        """Delete records matching query"""
+    
+    @abstractmethod
+    def update_many(self, updates: List[Tuple[Dict, Dict]]) -> int:
+        """Apply many (query, update) pairs in one write"""
+    
+    @abstractmethod
+    def upsert_many(self, records: List[Dict], key: str) -> List[Dict]:
+        """Insert or update many records by a key field in one write"""
+    
+    def find_many(
+        self,
+        query: Dict = None,
+        sort: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None
+    ) -> Iterator[Dict]:
+        """
+        Find records matching query (lazily, as a generator)
+        
+        Args:
+            query: Field values to match (all records if None)
+            sort: Field to order by, prefixed with '-' for descending
+                  (default: insertion order)
+            fields: Only return these fields of each record
+            offset: Number of matching records to skip
+            limit: Maximum number of records to return
+            cursor: Continue after the page that returned this cursor
+                    (see find_page)
+        
+        Yields:
+            Copies of the matching records (or their projections)
+        """
+        after = _decode_cursor(cursor) if cursor else None
+        max_rows = offset + limit if limit is not None else None
+        rows = self._find(query, sort, after, max_rows, fields)
+        for _, _, record in islice(rows, offset, max_rows):
+            yield _project(record, fields)
+    
+    def find_page(
+        self,
+        query: Dict = None,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        sort: Optional[str] = None,
+        fields: Optional[List[str]] = None
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        One page of matching records, with keyset pagination
+        
+        Args:
+            query: Field values to match
+            limit: Page size
+            cursor: Cursor returned with the previous page (None for the first page)
+            sort: Field to order by, prefixed with '-' for descending
+            fields: Only return these fields of each record
+        
+        Returns:
+            (records, cursor of the next page or None if this is the last one)
+        """
+        after = _decode_cursor(cursor) if cursor else None
+        rows = list(islice(self._find(query, sort, after, limit + 1, fields), limit + 1))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1][0], rows[-1][1])
+        return [_project(record, fields) for _, _, record in rows], next_cursor
+
+
+class Database(DocumentDatabase):
+    """
+    Thread- and process-safe JSON database for local storage
+    
+    Every change is a read-modify-write under a cross-process file lock,
+    and the file is replaced atomically, so readers (in any process) never
+    need the lock and never see a partly written file.
+    """
     
     def __init__(self, db_path: Path):
         self.db_path = db_path
-        self.lock = threading.Lock()
+        self.lock = FileLock(lock_path(db_path))
+        self._batch_local = threading.local()
         self._ensure_db_exists()
     
     def _ensure_db_exists(self):
         """Create database file if it doesn't exist"""
         if not self.db_path.exists():
             with self.lock:
-                self.db_path.write_text(json.dumps([], indent=2))
+                if not self.db_path.exists():
+                    self._store([])
     
-    def read(self) -> List[Dict]:
-        """Read all records from database"""
+    def _current_batch(self) -> Optional[_Batch]:
+        """Batch open in the current thread, if any"""
+        return getattr(self._batch_local, 'batch', None)
+    
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Group many operations into one read and one atomic write
+        
+        Inside the block the file is read once and every write only updates
+        the working copy; it is written once when the block exits without an
+        exception (and discarded otherwise). Other threads and processes
+        wait for the block. Nested batches join the outer one.
+        """
+        if self._current_batch() is not None:
+            yield
+            return
+        
         with self.lock:
+            batch = _Batch()
+            self._batch_local.batch = batch
             try:
-                return json.loads(self.db_path.read_text())
-            except Exception as e:
-                print(f"Error reading database: {e}")
-                return []
+                yield
+            finally:
+                self._batch_local.batch = None
+            
+            if batch.dirty:
+                self._store(batch.data)
     
-    def write(self, data: List[Dict]):
-        """Write all records to database"""
+    def _load(self) -> List[Dict]:
+        """Parse the database file (no lock needed: writes replace it atomically)"""
+        try:
+            return json.loads(self.db_path.read_text())
+        except Exception as e:
+            print(f"Error reading database: {e}")
+            return []
+    
+    def _store(self, data: List[Dict]) -> bool:
+        """Replace the database file atomically (temp file + os.replace)"""
         with self.lock:
             try:
-                self.db_path.write_text(json.dumps(data, indent=2, ensure_ascii=False))
+                tmp_path = self.db_path.with_name(f"{self.db_path.name}.{os.getpid()}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(json.dumps(data, indent=2, ensure_ascii=False))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.db_path)
+                return True
             except Exception as e:
                 print(f"Error writing database: {e}")
+                return False
+    
+    def read(self) -> List[Dict]:
+        """Read all records from database"""
+        batch = self._current_batch()
+        if batch is None:
+            return self._load()
+        if batch.data is None:
+            batch.data = self._load()
+        return batch.data
+    
+    def write(self, data: List[Dict]) -> bool:
+        """Write all records to database"""
+        batch = self._current_batch()
+        if batch is None:
+            return self._store(data)
+        batch.data = data
+        batch.dirty = True
+        return True
     
     def find_one(self, query: Dict) -> Optional[Dict]:
         """Find first record matching query"""
@@ -47,65 +297,541 @@ class Database:
                 return record
         return None
     
-    def find_many(self, query: Dict = None) -> List[Dict]:
-        """Find all records matching query"""
-        data = self.read()
-        if query is None:
-            return data
+    def _scan(self) -> List[Dict]:
+        """Records to search (callers must not modify them)"""
+        return self.read()
+    
+    def _find(
+        self,
+        query: Optional[Dict],
+        sort: Optional[str],
+        after: Optional[Tuple[Any, int]],
+        max_rows: Optional[int],
+        fields: Optional[List[str]] = None
+    ) -> Iterator[Tuple[Any, int, Dict]]:
+        """
+        Yield (sort value, position, record) for matching records in order
+        
+        Unsorted results are produced lazily in file order. Sorted results
+        are ordered by the sort field, then position; with max_rows only that
+        many are selected (heap, not a full sort).
+        """
+        query = query or {}
+        field, descending = _parse_sort(sort)
+        matches = (
+            (position, record) for position, record in enumerate(self._scan())
+            if all(record.get(k) == v for k, v in query.items())
+        )
+        
+        if field is None:
+            start = after[1] if after else -1
+            for position, record in matches:
+                if position > start:
+                    yield None, position, record
+            return
+        
+        def key(match):
+            return _sort_key(match[1].get(field)), match[0]
+        
+        if after:
+            after_key = (_sort_key(after[0]), after[1])
+            matches = (
+                match for match in matches
+                if (key(match) < after_key if descending else key(match) > after_key)
+            )
+        
+        if max_rows is None:
+            ordered = sorted(matches, key=key, reverse=descending)
+        elif descending:
+            ordered = heapq.nlargest(max_rows, matches, key=key)
+        else:
+            ordered = heapq.nsmallest(max_rows, matches, key=key)
+        
+        for position, record in ordered:
+            yield record.get(field), position, record
+    
+    def count(self, query: Dict = None) -> int:
+        """Number of records matching query"""
+        query = query or {}
+        return sum(
+            1 for record in self._scan()
+            if all(record.get(k) == v for k, v in query.items())
+        )
+    
+    def insert(self, record: Dict) -> Dict:
+        """Insert a new record"""
+        with self.batch():
+            data = self.read()
+            record['_created_at'] = datetime.utcnow().isoformat()
+            record['_updated_at'] = datetime.utcnow().isoformat()
+            data.append(record)
+            self.write(data)
+        return record
+    
+    def update(self, query: Dict, update: Dict) -> int:
+        """Update records matching query"""
+        with self.batch():
+            data = self.read()
+            updated_count = 0
+            
+            for record in data:
+                if all(record.get(k) == v for k, v in query.items()):
+                    record.update(update)
+                    record['_updated_at'] = datetime.utcnow().isoformat()
+                    updated_count += 1
+            
+            if updated_count > 0:
+                self.write(data)
+        
+        return updated_count
+    
+    def delete(self, query: Dict) -> int:
+        """Delete records matching query"""
+        with self.batch():
+            data = self.read()
+            original_count = len(data)
+            
+            data = [
+                record for record in data
+                if not all(record.get(k) == v for k, v in query.items())
+            ]
+            
+            deleted_count = original_count - len(data)
+            if deleted_count > 0:
+                self.write(data)
+        
+        return deleted_count
+    
+    def update_many(self, updates: List[Tuple[Dict, Dict]]) -> int:
+        """
+        Apply many updates with one read and one write
+        
+        Args:
+            updates: List of (query, update) pairs, applied in order
+        
+        Returns:
+            Number of record updates applied
+        """
+        if not updates:
+            return 0
+        
+        with self.batch():
+            data = self.read()
+            now = datetime.utcnow().isoformat()
+            
+            # Queries on one shared field that no update changes are matched through a dict
+            index = None
+            query_fields = {tuple(query) for query, _ in updates}
+            if len(query_fields) == 1 and len(next(iter(query_fields))) == 1:
+                field = next(iter(query_fields))[0]
+                if not any(field in update for _, update in updates):
+                    index = {}
+                    for record in data:
+                        index.setdefault(record.get(field), []).append(record)
+            
+            updated_count = 0
+            for query, update in updates:
+                if index is not None:
+                    matches = index.get(query[field], [])
+                else:
+                    matches = [
+                        record for record in data
+                        if all(record.get(k) == v for k, v in query.items())
+                    ]
+                for record in matches:
+                    record.update(update)
+                    record['_updated_at'] = now
+                    updated_count += 1
+            
+            if updated_count > 0:
+                self.write(data)
+        
+        return updated_count
+    
+    def upsert_many(self, records: List[Dict], key: str) -> List[Dict]:
+        """
+        Insert or update many records by a key field with one read and one write
+        
+        Args:
+            records: Records to store (each must contain key)
+            key: Field identifying a record
+        
+        Returns:
+            Stored version of each record
+        """
+        if not records:
+            return []
+        
+        with self.batch():
+            data = self.read()
+            now = datetime.utcnow().isoformat()
+            
+            index: Dict[Any, List[Dict]] = {}
+            for record in data:
+                index.setdefault(record.get(key), []).append(record)
+            
+            results = []
+            for record in records:
+                existing = index.get(record[key])
+                if existing:
+                    for match in existing:
+                        match.update(record)
+                        match['_updated_at'] = now
+                    results.append(dict(existing[0]))
+                else:
+                    record['_created_at'] = now
+                    record['_updated_at'] = now
+                    data.append(record)
+                    index[record[key]] = [record]
+                    results.append(record)
+            
+            self.write(data)
         
-        results = []
-        for record in data:
-            if all(record.get(k) == v for k, v in query.items()):
-                results.append(record)
         return results
+
+
+class SQLiteDatabase(DocumentDatabase):
+    """
+    SQLite database with the same interface as the JSON Database
+    
+    Records are stored as JSON documents. Fields listed in indexed_fields
+    are also kept in indexed columns, so queries on them are index lookups
+    instead of full parses and scans. Each thread gets its own connection;
+    the file runs in WAL mode so readers (e.g. the dashboard) don't block
+    the writer.
+    """
+    
+    def __init__(self, db_path: Path, table: str, indexed_fields: Tuple[str, ...] = ()):
+        self.db_path = db_path
+        self.table = table
+        self.indexed_fields = tuple(indexed_fields)
+        self._local = threading.local()
+        self._ensure_db_exists()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        # A connection must not be used across fork (pre-forking WSGI workers)
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit mode; transactions are explicit (see _transaction)
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction (takes the write lock up front); joins an open batch"""
+        conn = self._connect()
+        if getattr(self._local, 'in_batch', False):
+            yield conn
+            return
+        
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+    
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group many operations into one transaction (committed when the block exits cleanly)"""
+        if getattr(self._local, 'in_batch', False):
+            yield
+            return
+        
+        with self._transaction():
+            self._local.in_batch = True
+            try:
+                yield
+            finally:
+                self._local.in_batch = False
+    
+    def _ensure_db_exists(self):
+        """Create database file, table and indexes if they don't exist"""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        columns = ''.join(f', "{field}"' for field in self.indexed_fields)
+        with self._transaction() as conn:
+            conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} '
+                f'(id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL{columns})'
+            )
+            for field in self.indexed_fields:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_{field} ON {self.table} ("{field}")')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    
+    @staticmethod
+    def _column_value(value: Any) -> Any:
+        """Value of a record field as stored in an indexed column"""
+        if value is None or isinstance(value, (str, int, float)):
+            return value
+        return json.dumps(value, ensure_ascii=False)
+    
+    def _row_values(self, record: Dict) -> List[Any]:
+        """data and indexed column values for a record"""
+        return [json.dumps(record, ensure_ascii=False)] + [
+            self._column_value(record.get(field)) for field in self.indexed_fields
+        ]
+    
+    def _insert_rows(self, conn: sqlite3.Connection, records: List[Dict]):
+        columns = ''.join(f', "{field}"' for field in self.indexed_fields)
+        placeholders = ', '.join('?' * (len(self.indexed_fields) + 1))
+        conn.executemany(
+            f'INSERT INTO {self.table} (data{columns}) VALUES ({placeholders})',
+            [self._row_values(record) for record in records]
+        )
+    
+    def _update_row(self, conn: sqlite3.Connection, row_id: int, record: Dict):
+        assignments = ''.join(f', "{field}" = ?' for field in self.indexed_fields)
+        conn.execute(
+            f'UPDATE {self.table} SET data = ?{assignments} WHERE id = ?',
+            self._row_values(record) + [row_id]
+        )
+    
+    def _select(self, conn: sqlite3.Connection, query: Optional[Dict] = None) -> Iterator[Tuple[int, Dict]]:
+        """
+        Yield (row id, record) for records matching query, in insertion order
+        
+        Indexed fields are filtered in SQL, any other fields in Python.
+        """
+        query = query or {}
+        clauses = []
+        params = []
+        remaining = {}
+        for key, value in query.items():
+            if key in self.indexed_fields:
+                clauses.append(f'"{key}" IS ?')
+                params.append(self._column_value(value))
+            else:
+                remaining[key] = value
+        
+        sql = f'SELECT id, data FROM {self.table}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY id'
+        
+        for row_id, data in conn.execute(sql, params).fetchall():
+            record = json.loads(data)
+            if all(record.get(k) == v for k, v in remaining.items()):
+                yield row_id, record
+    
+    def read(self) -> List[Dict]:
+        """Read all records from database"""
+        try:
+            return [record for _, record in self._select(self._connect())]
+        except Exception as e:
+            print(f"Error reading database: {e}")
+            return []
+    
+    def write(self, data: List[Dict]) -> bool:
+        """Write all records to database"""
+        try:
+            with self._transaction() as conn:
+                conn.execute(f'DELETE FROM {self.table}')
+                self._insert_rows(conn, data)
+            return True
+        except Exception as e:
+            print(f"Error writing database: {e}")
+            return False
+    
+    def find_one(self, query: Dict) -> Optional[Dict]:
+        """Find first record matching query"""
+        for _, record in self._select(self._connect(), query):
+            return record
+        return None
+    
+    def _sort_expression(self, field: str) -> Tuple[str, List[Any]]:
+        """SQL expression (and parameters) for a record field"""
+        if field in self.indexed_fields:
+            return f'"{field}"', []
+        return 'json_extract(data, ?)', [f'$."{field}"']
+    
+    def _find(
+        self,
+        query: Optional[Dict],
+        sort: Optional[str],
+        after: Optional[Tuple[Any, int]],
+        max_rows: Optional[int],
+        fields: Optional[List[str]] = None
+    ) -> Iterator[Tuple[Any, int, Dict]]:
+        """
+        Yield (sort value, row id, record) for matching records in order
+        
+        Filters on indexed fields, ordering, the cursor and the row limit are
+        evaluated by SQLite; rows are fetched lazily. When every filter is in
+        SQL, a projection is also extracted in SQL, so full documents are not
+        parsed.
+        """
+        query = query or {}
+        field, descending = _parse_sort(sort)
+        clauses = []
+        params: List[Any] = []
+        remaining = {}
+        for key, value in query.items():
+            if key in self.indexed_fields:
+                clauses.append(f'"{key}" IS ?')
+                params.append(self._column_value(value))
+            else:
+                remaining[key] = value
+        
+        if field is None:
+            sort_sql, sort_params = 'NULL', []
+            order = 'id'
+            if after:
+                clauses.append('id > ?')
+                params.append(after[1])
+        else:
+            sort_sql, sort_params = self._sort_expression(field)
+            direction = 'DESC' if descending else 'ASC'
+            order = f'{sort_sql} {direction}, id {direction}'
+            if after:
+                value, row_id = self._column_value(after[0]), after[1]
+                # SQLite sorts NULL first, so it is the smallest value
+                if value is None and descending:
+                    clauses.append(f'({sort_sql} IS NULL AND id < ?)')
+                    params += sort_params + [row_id]
+                elif value is None:
+                    clauses.append(f'({sort_sql} IS NOT NULL OR id > ?)')
+                    params += sort_params + [row_id]
+                elif descending:
+                    clauses.append(f'({sort_sql} < ? OR {sort_sql} IS NULL OR ({sort_sql} = ? AND id < ?))')
+                    params += sort_params + [value] + sort_params + sort_params + [value, row_id]
+                else:
+                    clauses.append(f'({sort_sql} > ? OR ({sort_sql} = ? AND id > ?))')
+                    params += sort_params + [value] + sort_params + [value, row_id]
+        
+        data_sql, data_params = 'data', []
+        if fields is not None and not remaining:
+            pairs = ', '.join('?, json_extract(data, ?)' for _ in fields)
+            data_sql = f'json_object({pairs})'
+            for name in fields:
+                data_params += [name, f'$."{name}"']
+        
+        sql = f'SELECT {sort_sql}, id, {data_sql} FROM {self.table}'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += f' ORDER BY {order}'
+        if max_rows is not None and not remaining:
+            sql += f' LIMIT {int(max_rows)}'
+        
+        rows = self._connect().execute(sql, sort_params + data_params + params + sort_params)
+        try:
+            for sort_value, row_id, data in rows:
+                record = json.loads(data)
+                if all(record.get(k) == v for k, v in remaining.items()):
+                    yield sort_value, row_id, record
+        finally:
+            rows.close()
+    
+    def count(self, query: Dict = None) -> int:
+        """Number of records matching query"""
+        query = query or {}
+        if all(key in self.indexed_fields for key in query):
+            sql = f'SELECT COUNT(*) FROM {self.table}'
+            if query:
+                sql += ' WHERE ' + ' AND '.join(f'"{key}" IS ?' for key in query)
+            params = [self._column_value(value) for value in query.values()]
+            return self._connect().execute(sql, params).fetchone()[0]
+        return sum(1 for _ in self._select(self._connect(), query))
     
     def insert(self, record: Dict) -> Dict:
         """Insert a new record"""
-        data = self.read()
         record['_created_at'] = datetime.utcnow().isoformat()
         record['_updated_at'] = datetime.utcnow().isoformat()
-        data.append(record)
-        self.write(data)
+        with self._transaction() as conn:
+            self._insert_rows(conn, [record])
         return record
     
     def update(self, query: Dict, update: Dict) -> int:
         """Update records matching query"""
-        data = self.read()
         updated_count = 0
-        
-        for record in data:
-            if all(record.get(k) == v for k, v in query.items()):
+        with self._transaction() as conn:
+            for row_id, record in list(self._select(conn, query)):
                 record.update(update)
                 record['_updated_at'] = datetime.utcnow().isoformat()
+                self._update_row(conn, row_id, record)
                 updated_count += 1
-        
-        if updated_count > 0:
-            self.write(data)
-        
         return updated_count
     
     def delete(self, query: Dict) -> int:
         """Delete records matching query"""
-        data = self.read()
-        original_count = len(data)
+        with self._transaction() as conn:
+            row_ids = [(row_id,) for row_id, _ in self._select(conn, query)]
+            conn.executemany(f'DELETE FROM {self.table} WHERE id = ?', row_ids)
+        return len(row_ids)
+    
+    def update_many(self, updates: List[Tuple[Dict, Dict]]) -> int:
+        """Apply many (query, update) pairs in one transaction"""
+        with self.batch():
+            return sum(self.update(query, update) for query, update in updates)
+    
+    def upsert_many(self, records: List[Dict], key: str) -> List[Dict]:
+        """Insert or update many records by a key field in one transaction"""
+        results = []
+        with self.batch():
+            for record in records:
+                existing = self.find_one({key: record[key]})
+                if existing:
+                    self.update({key: record[key]}, record)
+                    results.append({**existing, **record})
+                else:
+                    results.append(self.insert(record))
+        return results
+    
+    def migrate_from_json(self, json_path: Path) -> int:
+        """
+        Import the records of a JSON database file, once
         
-        data = [
-            record for record in data
-            if not all(record.get(k) == v for k, v in query.items())
-        ]
+        The JSON file is left in place; the import is recorded in the meta
+        table so it never runs again.
         
-        deleted_count = original_count - len(data)
-        if deleted_count > 0:
-            self.write(data)
+        Args:
+            json_path: JSON database file
         
-        return deleted_count
+        Returns:
+            Number of records imported (0 if already migrated)
+        """
+        marker = f'migrated_from_json:{self.table}'
+        with self._transaction() as conn:
+            if conn.execute('SELECT 1 FROM meta WHERE key = ?', (marker,)).fetchone():
+                return 0
+            
+            records = json.loads(json_path.read_text()) if json_path.exists() else []
+            self._insert_rows(conn, records)
+            conn.execute(
+                'INSERT INTO meta (key, value) VALUES (?, ?)',
+                (marker, datetime.utcnow().isoformat())
+            )
+        return len(records)
 
 
-class WorkersDatabase(Database):
-    """Database for worker records"""
+class _WorkerIndex:
+    """Worker records with hash lookups by national ID and worker ID and status buckets"""
     
-    def __init__(self):
-        super().__init__(Config.WORKERS_DB)
+    def __init__(self, records: List[Dict]):
+        self.records = records
+        self.by_national_id: Dict[str, Dict] = {}
+        self.by_worker_id: Dict[str, Dict] = {}
+        self.by_status: Dict[str, List[Dict]] = {}
+        for record in records:
+            # First match wins, like find_one
+            self.by_national_id.setdefault(record.get('nationalIdNumber'), record)
+            self.by_worker_id.setdefault(record.get('workerId'), record)
+            self.by_status.setdefault(record.get('status'), []).append(record)
+
+
+class WorkerQueries:
+    """
+    Worker record API shared by the JSON and SQLite backends
+    
+    Built only on the generic database interface (read, find_one,
+    find_many, batch, insert, update, update_many, upsert_many); backends
+    override the lookups with their faster paths.
+    """
     
     def get_by_national_id(self, national_id: str) -> Optional[Dict]:
         """Get worker by national ID"""
@@ -115,122 +841,759 @@ class WorkersDatabase(Database):
         """Get worker by worker ID"""
         return self.find_one({'workerId': worker_id})
     
+    def get_workers_by_status(self, status: str) -> List[Dict]:
+        """Get workers by status"""
+        return list(self.find_many({'status': status}))
+    
     def upsert_worker(self, worker_data: Dict) -> Dict:
         """Insert or update worker"""
-        existing = self.get_by_national_id(worker_data['nationalIdNumber'])
-        
-        if existing:
-            self.update(
-                {'nationalIdNumber': worker_data['nationalIdNumber']},
-                worker_data
-            )
-            return {**existing, **worker_data}
-        else:
-            return self.insert(worker_data)
+        with self.batch():
+            existing = self.get_by_national_id(worker_data['nationalIdNumber'])
+            
+            if existing:
+                self.update(
+                    {'nationalIdNumber': worker_data['nationalIdNumber']},
+                    worker_data
+                )
+                return {**existing, **worker_data}
+            else:
+                return self.insert(worker_data)
+    
+    def upsert_workers(self, workers: List[Dict]) -> List[Dict]:
+        """Insert or update many workers (by national ID) in one write"""
+        return self.upsert_many(workers, key='nationalIdNumber')
     
     def get_all_workers(self) -> List[Dict]:
         """Get all workers"""
         return self.read()
     
+    def set_face_encodings(self, encodings: Dict[str, Dict]) -> int:
+        """
+        Store refreshed face encoding fields for many workers in one write
+        
+        Args:
+            encodings: Mapping of national ID -> face encoding fields
+        
+        Returns:
+            Number of workers updated
+        """
+        return self.update_many([
+            ({'nationalIdNumber': national_id}, fields)
+            for national_id, fields in encodings.items()
+        ])
+
+
+class WorkersDatabase(WorkerQueries, Database):
+    """
+    Database for worker records
+    
+    Records are cached in process with indexes by national ID, worker ID and
+    status. Writes through this instance update the cache directly; writes
+    by another process are picked up by checking the file's inode, mtime
+    and size. Records are returned as copies so callers can't alter the cache.
+    """
+    
+    def __init__(self):
+        self._cache: Optional[_WorkerIndex] = None
+        self._cache_key: Optional[Tuple[int, int, int]] = None
+        self._cache_lock = threading.Lock()
+        super().__init__(Config.WORKERS_DB)
+    
+    def _file_key(self) -> Optional[Tuple[int, int, int]]:
+        """Identity of the current file contents (inode, mtime, size)"""
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _index(self) -> _WorkerIndex:
+        """Cached indexes, reloaded if the file changed"""
+        key = self._file_key()
+        with self._cache_lock:
+            if self._cache is not None and key is not None and key == self._cache_key:
+                return self._cache
+        
+        index = _WorkerIndex(super()._load())
+        with self._cache_lock:
+            self._cache = index
+            self._cache_key = key
+        return index
+    
+    def _load(self) -> List[Dict]:
+        """Read all records (from the cache if the file is unchanged)"""
+        return [dict(record) for record in self._index().records]
+    
+    def _store(self, data: List[Dict]) -> bool:
+        """Write all records and refresh the cache"""
+        written = super()._store(data)
+        with self._cache_lock:
+            if written:
+                self._cache = _WorkerIndex([dict(record) for record in data])
+                self._cache_key = self._file_key()
+            else:
+                self._cache = None
+                self._cache_key = None
+        return written
+    
+    def get_by_national_id(self, national_id: str) -> Optional[Dict]:
+        """Get worker by national ID"""
+        if self._current_batch() is not None:
+            # The cache doesn't see uncommitted batch changes
+            return super().get_by_national_id(national_id)
+        record = self._index().by_national_id.get(national_id)
+        return dict(record) if record else None
+    
+    def get_by_worker_id(self, worker_id: str) -> Optional[Dict]:
+        """Get worker by worker ID"""
+        if self._current_batch() is not None:
+            return super().get_by_worker_id(worker_id)
+        record = self._index().by_worker_id.get(worker_id)
+        return dict(record) if record else None
+    
     def get_workers_by_status(self, status: str) -> List[Dict]:
         """Get workers by status"""
-        return self.find_many({'status': status})
+        if self._current_batch() is not None:
+            return super().get_workers_by_status(status)
+        return [dict(record) for record in self._index().by_status.get(status, [])]
+    
+    def _scan(self) -> List[Dict]:
+        """Cached records, without copying (find_many copies what it returns)"""
+        if self._current_batch() is not None:
+            return self.read()
+        return self._index().records
 
 
-class RequestLogsDatabase(Database):
-    """Database for API request logs"""
+class SQLiteWorkersDatabase(WorkerQueries, SQLiteDatabase):
+    """
+    Worker records in SQLite, indexed by national ID, worker ID and status
+    
+    The WorkerQueries lookups are SQL index lookups here, so there is no
+    in-process cache as in the JSON WorkersDatabase.
+    """
     
     def __init__(self):
-        super().__init__(Config.REQUEST_LOGS_DB)
+        super().__init__(
+            Config.WORKERS_SQLITE_DB,
+            table='workers',
+            indexed_fields=('nationalIdNumber', 'workerId', 'status')
+        )
+        migrated = self.migrate_from_json(Config.WORKERS_DB)
+        if migrated:
+            logger.info(f"Migrated {migrated} workers from {Config.WORKERS_DB} to {Config.WORKERS_SQLITE_DB}")
+
+
+def open_workers_database() -> WorkerQueries:
+    """Workers database for the configured backend (Config.WORKERS_DB_BACKEND)"""
+    if Config.WORKERS_DB_BACKEND == 'sqlite':
+        return SQLiteWorkersDatabase()
+    return WorkersDatabase()
+
+
+class RequestStats:
+    """
+    Request statistics maintained incrementally as logs are added
     
-    def add_log(self, log_data: Dict) -> Dict:
-        """Add a new request log"""
-        # Clean up old logs if exceeding max
-        logs = self.read()
-        if len(logs) >= Config.MAX_REQUEST_LOGS:
-            # Keep only the most recent logs
-            logs = logs[-(Config.MAX_REQUEST_LOGS - 1):]
-            self.write(logs)
-        
-        return self.insert(log_data)
-    
-    def get_recent_logs(self, limit: int = 100, filters: Dict = None) -> List[Dict]:
-        """Get recent logs with optional filtering"""
-        logs = self.read()
-        
-        # Apply filters
-        if filters:
-            filtered_logs = []
-            for log in logs:
-                match = True
-                
-                # Filter by API target
-                if filters.get('api_target') and log.get('api_target') != filters['api_target']:
-                    match = False
-                
-                # Filter by success status
-                if filters.get('success') is not None:
-                    log_success = 200 <= log.get('status_code', 500) < 300
-                    if log_success != filters['success']:
-                        match = False
-                
-                # Filter by date range
-                if filters.get('start_date'):
-                    log_time = datetime.fromisoformat(log.get('timestamp', ''))
-                    if log_time < datetime.fromisoformat(filters['start_date']):
-                        match = False
-                
-                if filters.get('end_date'):
-                    log_time = datetime.fromisoformat(log.get('timestamp', ''))
-                    if log_time > datetime.fromisoformat(filters['end_date']):
-                        match = False
-                
-                # Filter by endpoint
-                if filters.get('endpoint') and filters['endpoint'].lower() not in log.get('endpoint', '').lower():
-                    match = False
-                
-                if match:
-                    filtered_logs.append(log)
-            
-            logs = filtered_logs
-        
-        # Sort by timestamp descending and limit
-        logs = sorted(logs, key=lambda x: x.get('timestamp', ''), reverse=True)
-        return logs[:limit]
+    Each stat holds count, failures, duration sum and a latency histogram.
+    Stats are kept overall, per API target + endpoint, and in per-minute
+    (last MINUTE_ROLLUP_HOURS) and per-hour (log retention period) rollups
+    by the same key. They are persisted to Config.REQUEST_STATS_PATH, so
+    queries never scan the logs.
     
-    def get_stats(self) -> Dict[str, Any]:
-        """Get statistics about request logs"""
-        logs = self.read()
+    Several processes can share the file: each saves the requests it counted
+    since its last save on top of the file's current contents (under a file
+    lock), and queries reload the file when another process has saved.
+    """
+    
+    # Upper bounds (ms) of the latency histogram buckets; one more open-ended bucket follows
+    LATENCY_BUCKETS_MS = [
+        5, 10, 25, 50, 75, 100, 150, 200, 300, 400, 500, 750,
+        1000, 1500, 2000, 3000, 5000, 7500, 10000, 20000, 30000, 60000
+    ]
+    MINUTE_ROLLUP_HOURS = 24
+    MAX_ENDPOINTS = 200
+    SAVE_INTERVAL_SECONDS = 5.0
+    
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or Config.REQUEST_STATS_PATH
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(lock_path(self.path))
+        self.total = self._empty()
+        self.endpoints: Dict[str, Dict] = {}
+        self.minutes: Dict[str, Dict[str, Dict]] = {}
+        self.hours: Dict[str, Dict[str, Dict]] = {}
+        self._pending: List[Tuple] = []  # counted here, not yet in the file
+        self._file_key: Optional[Tuple[int, int, int]] = None
+        self._dirty = False
+        self._last_save = 0.0
+        self.loaded = self._load()
+    
+    @classmethod
+    def _empty(cls) -> Dict:
+        return {
+            'count': 0,
+            'failures': 0,
+            'duration_sum': 0,
+            'histogram': [0] * (len(cls.LATENCY_BUCKETS_MS) + 1)
+        }
+    
+    def _stat_key(self) -> Optional[Tuple[int, int, int]]:
+        """Identity of the stats file contents (inode, mtime, size)"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    
+    def _load(self) -> bool:
+        """Load persisted stats (False if missing or written with other buckets)"""
+        key = self._stat_key()
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"Error reading request stats: {e}")
+            return False
         
-        if not logs:
-            return {
-                'total_requests': 0,
-                'success_rate': 0,
-                'avg_duration': 0,
-                'failed_requests': 0
-            }
+        if data.get('buckets') != self.LATENCY_BUCKETS_MS:
+            return False
+        
+        self.total = data['total']
+        self.endpoints = data['endpoints']
+        self.minutes = data['minutes']
+        self.hours = data['hours']
+        self._file_key = key
+        return True
+    
+    def _refresh(self):
+        """Reload if another process saved, keeping our unsaved counts (call with lock held)"""
+        key = self._stat_key()
+        if key is None or key == self._file_key:
+            return
+        if self._load():
+            for entry in self._pending:
+                self._apply(*entry)
+    
+    def save(self, force: bool = False):
+        """Persist the stats (at most every SAVE_INTERVAL_SECONDS unless forced)"""
+        with self.lock:
+            if not self._dirty or (not force and time.monotonic() - self._last_save < self.SAVE_INTERVAL_SECONDS):
+                return
+        
+        with self.file_lock, self.lock:
+            self._refresh()
+            data = json.dumps({
+                'buckets': self.LATENCY_BUCKETS_MS,
+                'total': self.total,
+                'endpoints': self.endpoints,
+                'minutes': self.minutes,
+                'hours': self.hours
+            })
+            try:
+                tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+                tmp_path.write_text(data)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                print(f"Error writing request stats: {e}")
+                return
+            self._file_key = self._stat_key()
+            self._pending.clear()
+            self._dirty = False
+            self._last_save = time.monotonic()
+    
+    @classmethod
+    def endpoint_key(cls, api_target: str, endpoint: str) -> str:
+        """
+        Low-cardinality key for an endpoint
+        
+        The API base URL and query string are dropped, and path segments that
+        are file names or IDs are collapsed, so e.g. every image download
+        counts towards one key.
+        """
+        endpoint = endpoint or ''
+        for base_url in (Config.SUPABASE_BASE_URL, Config.HIKCENTRAL_BASE_URL):
+            if base_url and endpoint.startswith(base_url):
+                endpoint = endpoint[len(base_url):]
+                break
+        
+        parts = []
+        for part in urlparse(endpoint).path.split('/'):
+            if '.' in part:
+                part = '{file}'
+            elif part.isdigit() or (len(part) >= 16 and sum(c.isdigit() for c in part) >= 4):
+                part = '{id}'
+            parts.append(part)
+        return f"{api_target} {'/'.join(parts)}"
+    
+    @classmethod
+    def _add_to(cls, stat: Dict, failed: bool, duration_ms: int, bucket: int):
+        stat['count'] += 1
+        stat['failures'] += failed
+        stat['duration_sum'] += duration_ms
+        stat['histogram'][bucket] += 1
+    
+    def add(self, log: Dict):
+        """Count one request log"""
+        timestamp = log.get('timestamp', '')
+        status_code = log.get('status_code', 500)
+        failed = not 200 <= status_code < 300
+        duration_ms = log.get('duration_ms') or 0
+        bucket = bisect_left(self.LATENCY_BUCKETS_MS, duration_ms)
+        minute = timestamp[:16]
+        hour = timestamp[:13]
+        
+        with self.lock:
+            key = self.endpoint_key(log.get('api_target', ''), log.get('endpoint', ''))
+            if key not in self.endpoints and len(self.endpoints) >= self.MAX_ENDPOINTS:
+                key = f"{log.get('api_target', '')} (other)"
+            
+            if minute not in self.minutes:
+                self._prune()
+            
+            entry = (key, minute, hour, failed, duration_ms, bucket)
+            self._apply(*entry)
+            self._pending.append(entry)
+            self._dirty = True
+    
+    def _apply(self, key: str, minute: str, hour: str, failed: bool, duration_ms: int, bucket: int):
+        """Count one request in every stat it belongs to (call with lock held)"""
+        for stat in (
+            self.total,
+            self.endpoints.setdefault(key, self._empty()),
+            self.minutes.setdefault(minute, {}).setdefault(key, self._empty()),
+            self.hours.setdefault(hour, {}).setdefault(key, self._empty())
+        ):
+            self._add_to(stat, failed, duration_ms, bucket)
+    
+    def _prune(self):
+        """Drop rollups older than their retention (call with lock held)"""
+        now = datetime.utcnow()
+        minute_cutoff = (now - timedelta(hours=self.MINUTE_ROLLUP_HOURS)).isoformat()[:16]
+        hour_cutoff = (now - timedelta(days=Config.DASHBOARD_LOG_RETENTION_DAYS)).isoformat()[:13]
+        for rollups, cutoff in ((self.minutes, minute_cutoff), (self.hours, hour_cutoff)):
+            for period in [period for period in rollups if period < cutoff]:
+                del rollups[period]
+                self._dirty = True
+    
+    def prune(self):
+        """Drop rollups older than their retention"""
+        with self.lock:
+            self._prune()
+    
+    @classmethod
+    def percentile(cls, histogram: List[int], q: float) -> float:
+        """
+        Estimate a latency percentile from a histogram
         
-        successful = sum(1 for log in logs if 200 <= log.get('status_code', 500) < 300)
-        total = len(logs)
-        durations = [log.get('duration_ms', 0) for log in logs if log.get('duration_ms')]
+        Args:
+            histogram: Bucket counts (LATENCY_BUCKETS_MS)
+            q: Quantile between 0 and 1
         
+        Returns:
+            Latency in ms, interpolated linearly within the bucket
+        """
+        total = sum(histogram)
+        if not total:
+            return 0.0
+        
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(histogram):
+            if count and cumulative + count >= rank:
+                lower = cls.LATENCY_BUCKETS_MS[i - 1] if i > 0 else 0
+                if i < len(cls.LATENCY_BUCKETS_MS):
+                    upper = cls.LATENCY_BUCKETS_MS[i]
+                else:
+                    upper = lower * 2
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return float(cls.LATENCY_BUCKETS_MS[-1])
+    
+    @classmethod
+    def summarize(cls, stat: Dict) -> Dict[str, Any]:
+        """Counts, success rate, mean and p50/p95/p99 latency of a stat"""
+        count = stat['count']
         return {
-            'total_requests': total,
-            'success_rate': (successful / total * 100) if total > 0 else 0,
-            'avg_duration': sum(durations) / len(durations) if durations else 0,
-            'failed_requests': total - successful
+            'total_requests': count,
+            'success_rate': ((count - stat['failures']) / count * 100) if count > 0 else 0,
+            'avg_duration': stat['duration_sum'] / count if count > 0 else 0,
+            'failed_requests': stat['failures'],
+            'p50_duration': cls.percentile(stat['histogram'], 0.50),
+            'p95_duration': cls.percentile(stat['histogram'], 0.95),
+            'p99_duration': cls.percentile(stat['histogram'], 0.99)
         }
     
+    @classmethod
+    def _merge(cls, stats: Iterator[Dict]) -> Dict:
+        merged = cls._empty()
+        for stat in stats:
+            merged['count'] += stat['count']
+            merged['failures'] += stat['failures']
+            merged['duration_sum'] += stat['duration_sum']
+            merged['histogram'] = [a + b for a, b in zip(merged['histogram'], stat['histogram'])]
+        return merged
+    
+    def get_totals(self) -> Dict[str, Any]:
+        """Overall summary"""
+        with self.lock:
+            self._refresh()
+            return self.summarize(self.total)
+    
+    def get_endpoints(self) -> List[Dict[str, Any]]:
+        """Summary per API target + endpoint, busiest first"""
+        with self.lock:
+            self._refresh()
+            rows = [{'endpoint': key, **self.summarize(stat)} for key, stat in self.endpoints.items()]
+        return sorted(rows, key=lambda row: row['total_requests'], reverse=True)
+    
+    def get_histograms(self) -> Dict[str, Dict]:
+        """Raw stat (count, failures, duration sum, histogram) per API target + endpoint"""
+        with self.lock:
+            self._refresh()
+            return {
+                key: {**stat, 'histogram': list(stat['histogram'])}
+                for key, stat in self.endpoints.items()
+            }
+    
+    def get_timeline(self, resolution: str = 'minute', limit: int = 60) -> List[Dict[str, Any]]:
+        """
+        Summary per minute or hour (all endpoints combined), oldest first
+        
+        Args:
+            resolution: 'minute' or 'hour'
+            limit: Number of most recent periods with traffic
+        """
+        with self.lock:
+            self._refresh()
+            rollups = self.minutes if resolution == 'minute' else self.hours
+            periods = sorted(rollups)[-limit:]
+            return [
+                {'period': period, **self.summarize(self._merge(rollups[period].values()))}
+                for period in periods
+            ]
+
+
+class RequestLogsDatabase:
+    """
+    Append-only store for API request logs
+    
+    Logs are written as JSON lines to time-based segment files in
+    Config.REQUEST_LOGS_DIR (one file per Config.REQUEST_LOG_SEGMENT_MINUTES).
+    Adding a log is a single append to the current segment; retention deletes
+    whole segments, and reads walk the segments newest-first. Appends hold
+    a cross-process lock, so any number of processes can log and read.
+    Expired segments go to compressed daily archives if enabled.
+    """
+    
+    SEGMENT_PREFIX = 'requests-'
+    SEGMENT_SUFFIX = '.jsonl'
+    SEGMENT_TIME_FORMAT = '%Y%m%dT%H%M'
+    
+    def __init__(self, logs_dir: Optional[Path] = None):
+        self.logs_dir = logs_dir or Config.REQUEST_LOGS_DIR
+        self.segment_seconds = Config.REQUEST_LOG_SEGMENT_MINUTES * 60
+        # Appends from several processes (e.g. a separate dashboard) must not interleave
+        self.lock = FileLock(lock_path(self.logs_dir))
+        self._segment_path: Optional[Path] = None
+        self._segment_file = None
+        self.logs_dir.mkdir(parents=True, exist_ok=True)
+        self.index = RequestLogIndex()
+        self.archive = RequestLogArchive(Config.REQUEST_LOG_ARCHIVE_DIR, Config.REQUEST_LOG_ARCHIVE_COMPRESSION)
+        
+        # Only the first process to start migrates and builds the stats
+        with self.lock:
+            self._migrate_json()
+            self.stats = RequestStats()
+            if not self.stats.loaded:
+                self._rebuild_stats()
+    
+    def _rebuild_stats(self):
+        """Compute the running stats from the stored logs (first start only)"""
+        for _, path in reversed(self._segments()):
+            for log in self._read_segment(path):
+                self.stats.add(log)
+        self.stats.prune()
+        self.stats.save(force=True)
+    
+    def _segment_start(self, timestamp: datetime) -> datetime:
+        """Start of the segment a timestamp falls into"""
+        # Timestamps are naive UTC; .timestamp() would treat them as local time
+        seconds = int((timestamp - datetime(1970, 1, 1)).total_seconds())
+        return datetime(1970, 1, 1) + timedelta(seconds=seconds - seconds % self.segment_seconds)
+    
+    def _segment_name(self, timestamp: datetime) -> str:
+        return f"{self.SEGMENT_PREFIX}{self._segment_start(timestamp).strftime(self.SEGMENT_TIME_FORMAT)}{self.SEGMENT_SUFFIX}"
+    
+    def _segments(self) -> List[Tuple[datetime, Path]]:
+        """All segments as (start time, path), newest first"""
+        segments = []
+        for path in self.logs_dir.glob(f"{self.SEGMENT_PREFIX}*{self.SEGMENT_SUFFIX}"):
+            stamp = path.name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)]
+            try:
+                segments.append((datetime.strptime(stamp, self.SEGMENT_TIME_FORMAT), path))
+            except ValueError:
+                continue
+        segments.sort(reverse=True)
+        return segments
+    
+    @staticmethod
+    def _read_segment(path: Path, newest_first: bool = False) -> List[Dict]:
+        """Parse a segment, skipping a partially written last line"""
+        try:
+            lines = path.read_text(encoding='utf-8').splitlines()
+        except FileNotFoundError:
+            return []
+        
+        if newest_first:
+            lines.reverse()
+        
+        logs = []
+        for line in lines:
+            try:
+                logs.append(json.loads(line))
+            except ValueError:
+                continue
+        return logs
+    
+    def _migrate_json(self):
+        """One-shot import of the old request_logs.json into segments"""
+        json_path = Config.REQUEST_LOGS_DB
+        if not json_path.exists():
+            return
+        
+        try:
+            logs = json.loads(json_path.read_text() or '[]')
+        except Exception as e:
+            print(f"Error reading old request logs: {e}")
+            return
+        
+        by_segment: Dict[str, List[Dict]] = {}
+        for log in sorted(logs, key=lambda x: x.get('timestamp', '')):
+            try:
+                timestamp = datetime.fromisoformat(log.get('timestamp', ''))
+            except ValueError:
+                continue
+            by_segment.setdefault(self._segment_name(timestamp), []).append(log)
+        
+        for name, segment_logs in by_segment.items():
+            with open(self.logs_dir / name, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(log, ensure_ascii=False) + '\n' for log in segment_logs)
+        
+        json_path.rename(json_path.with_name(json_path.name + '.migrated'))
+        if logs:
+            print(f"Migrated {len(logs)} request logs to {self.logs_dir}")
+    
+    def add_log(self, log_data: Dict) -> Dict:
+        """Add a new request log (appends one line to the current segment)"""
+        self.add_logs([log_data])
+        return log_data
+    
+    def add_logs(self, logs: List[Dict], stats_only: List[Dict] = ()):
+        """
+        Append a batch of request logs with a single write
+        
+        Args:
+            logs: Logs to store
+            stats_only: Logs only counted in the stats (sampled out, not stored)
+        """
+        for log_data in stats_only:
+            self.stats.add(log_data)
+        if not logs:
+            self.stats.save()
+            return
+        
+        now = datetime.utcnow()
+        for log_data in logs:
+            log_data['_created_at'] = now.isoformat()
+            log_data['_updated_at'] = now.isoformat()
+        data = ''.join(json.dumps(log_data, ensure_ascii=False) + '\n' for log_data in logs)
+        
+        with self.lock:
+            segment_path = self.logs_dir / self._segment_name(now)
+            if segment_path != self._segment_path:
+                if self._segment_file:
+                    self._segment_file.close()
+                self._segment_file = open(segment_path, 'a', encoding='utf-8')
+                self._segment_path = segment_path
+                rolled_over = True
+            else:
+                rolled_over = False
+            
+            self._segment_file.write(data)
+            self._segment_file.flush()
+        
+        for log_data in logs:
+            self.stats.add(log_data)
+        self.stats.save()
+        
+        if rolled_over:
+            self._trim_segments()
+    
+    def _expire_segment(self, segment_start: datetime, path: Path):
+        """Move a segment out of the hot store (into the archive if enabled)"""
+        with self.lock:
+            if Config.REQUEST_LOG_ARCHIVE_ENABLED:
+                try:
+                    data = path.read_bytes()
+                except FileNotFoundError:
+                    return
+                self.archive.add_segment(segment_start, path.name, data)
+            path.unlink(missing_ok=True)
+    
+    def _trim_segments(self):
+        """Expire the oldest whole segments beyond Config.MAX_REQUEST_LOGS entries"""
+        total = 0
+        expired = []
+        for segment_start, path in self._segments():
+            if total >= Config.MAX_REQUEST_LOGS and path != self._segment_path:
+                expired.append((segment_start, path))
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    total += sum(1 for _ in f)
+            except FileNotFoundError:
+                continue
+        
+        # Oldest first, so archives stay in time order
+        for segment_start, path in reversed(expired):
+            self._expire_segment(segment_start, path)
+    
+    def get_recent_logs(
+        self,
+        limit: int = 100,
+        filters: Dict = None,
+        offset: int = 0,
+        fields: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """
+        Get recent logs with optional filtering, newest first
+        
+        Filters are evaluated as vectorized masks over the columnar log
+        index (binary search on time where a segment is in time order), and
+        only the returned rows are parsed. Segments are visited newest-first
+        until offset + limit rows matched; segments outside the date range
+        are skipped. With fields, each log is reduced to those fields.
+        """
+        filters = filters or {}
+        start_date = datetime.fromisoformat(filters['start_date']) if filters.get('start_date') else None
+        end_date = datetime.fromisoformat(filters['end_date']) if filters.get('end_date') else None
+        start_epoch = to_epoch(filters['start_date']) if start_date else None
+        end_epoch = to_epoch(filters['end_date']) if end_date else None
+        segment_span = timedelta(seconds=self.segment_seconds)
+        
+        segments = self._segments()
+        self.index.forget(path for _, path in segments)
+        
+        results = []
+        for segment_start, path in segments:
+            if end_date and segment_start > end_date:
+                continue
+            if start_date and segment_start + segment_span <= start_date:
+                break
+            
+            columns = self.index.columns(path)
+            if columns is None or not len(columns['offset']):
+                continue
+            
+            # Time range: binary search when the segment is in time order
+            first, last = 0, len(columns['offset'])
+            mask = np.ones(last, dtype=bool)
+            if start_epoch is not None or end_epoch is not None:
+                timestamps = columns['timestamp']
+                if columns['time_sorted']:
+                    if start_epoch is not None:
+                        first = int(np.searchsorted(timestamps, start_epoch, side='left'))
+                    if end_epoch is not None:
+                        last = int(np.searchsorted(timestamps, end_epoch, side='right'))
+                else:
+                    if start_epoch is not None:
+                        mask &= timestamps >= start_epoch
+                    if end_epoch is not None:
+                        mask &= timestamps <= end_epoch
+            if first >= last:
+                continue
+            
+            rows = slice(first, last)
+            mask = mask[rows]
+            
+            # Filter by API target (codes are known once the segment is indexed)
+            if filters.get('api_target'):
+                code = self.index.code_of('api_target', filters['api_target'])
+                if code is None:
+                    continue
+                mask &= columns['api_target'][rows] == code
+            
+            # Filter by success status
+            if filters.get('success') is not None:
+                status_codes = columns['status_code'][rows]
+                mask &= ((status_codes >= 200) & (status_codes < 300)) == filters['success']
+            
+            # Filter by endpoint
+            if filters.get('endpoint'):
+                mask &= np.isin(columns['endpoint'][rows], self.index.endpoint_codes_containing(filters['endpoint']))
+            
+            matched = (np.flatnonzero(mask) + first)[::-1]
+            skipped = min(offset, len(matched))
+            offset -= skipped
+            matched = matched[skipped:skipped + limit - len(results)]
+            if len(matched):
+                logs = self.index.read_rows(path, columns['offset'][matched], columns['length'][matched])
+                results.extend(_project(log, fields) if fields else log for log in logs)
+                if len(results) >= limit:
+                    break
+        
+        return results
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get statistics about request logs (running totals, no log scan)"""
+        return self.stats.get_totals()
+    
+    def get_endpoint_stats(self) -> List[Dict[str, Any]]:
+        """Get statistics per API target + endpoint"""
+        return self.stats.get_endpoints()
+    
+    def get_stats_timeline(self, resolution: str = 'minute', limit: int = 60) -> List[Dict[str, Any]]:
+        """Get per-minute or per-hour statistics"""
+        return self.stats.get_timeline(resolution, limit)
+    
+    def get_endpoint_histograms(self) -> Dict[str, Dict]:
+        """Get the raw latency histograms per API target + endpoint (RequestStats.LATENCY_BUCKETS_MS)"""
+        return self.stats.get_histograms()
+    
+    def get_archives(self) -> List[Dict]:
+        """Sidecar indexes of the archived days (time range, counts, errors)"""
+        return self.archive.list_archives()
+    
+    def iter_archived_logs(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Iterator[Dict]:
+        """Stream archived logs oldest first, optionally within a time range"""
+        return self.archive.iter_logs(start_date, end_date)
+    
+    def flush_stats(self):
+        """Persist the running stats now"""
+        self.stats.save(force=True)
+    
     def cleanup_old_logs(self):
-        """Remove logs older than retention period"""
-        logs = self.read()
-        cutoff_date = datetime.utcnow().timestamp() - (Config.DASHBOARD_LOG_RETENTION_DAYS * 86400)
+        """Expire segments older than the retention period, and archives past theirs"""
+        now = datetime.utcnow()
+        cutoff_date = now - timedelta(days=Config.DASHBOARD_LOG_RETENTION_DAYS)
+        segment_span = timedelta(seconds=self.segment_seconds)
         
-        cleaned_logs = [
-            log for log in logs
-            if datetime.fromisoformat(log.get('timestamp', '')).timestamp() > cutoff_date
-        ]
+        removed = 0
+        for segment_start, path in reversed(self._segments()):
+            if segment_start + segment_span <= cutoff_date and path != self._segment_path:
+                self._expire_segment(segment_start, path)
+                removed += 1
+        
+        if removed:
+            action = 'Archived' if Config.REQUEST_LOG_ARCHIVE_ENABLED else 'Cleaned up'
+            print(f"{action} {removed} old log segments")
+        
+        if Config.REQUEST_LOG_ARCHIVE_DAYS:
+            with self.lock:
+                pruned = self.archive.prune(now - timedelta(days=Config.REQUEST_LOG_ARCHIVE_DAYS))
+            if pruned:
+                print(f"Deleted {pruned} expired log archives")
         
-        if len(cleaned_logs) < len(logs):
-            self.write(cleaned_logs)
-            print(f"Cleaned up {len(logs) - len(cleaned_logs)} old logs")
+        self.stats.prune()
+        self.flush_stats()
@@ -348,17 +348,17 @@ print_step "Creating data directories..."
 
 mkdir -p $APP_DIR/data/faces
 mkdir -p $APP_DIR/data/id_cards
+mkdir -p $APP_DIR/data/request_logs
 
 # Create empty JSON files
 echo "[]" > $APP_DIR/data/workers.json
-echo "[]" > $APP_DIR/data/request_logs.json
 
 # Set proper permissions
 chmod 755 $APP_DIR/data
 chmod 755 $APP_DIR/data/faces
 chmod 755 $APP_DIR/data/id_cards
+chmod 755 $APP_DIR/data/request_logs
 chmod 644 $APP_DIR/data/workers.json
-chmod 644 $APP_DIR/data/request_logs.json
 
 print_success "Data directories created"
 
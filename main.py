@@ -4,28 +4,49 @@ Main entry point for HydePark sync system
 import time
 import schedule
 import threading
+from typing import Optional
 from config import Config
 from processors.event_processor import EventProcessor
 from dashboard.app import run_dashboard
+from utils.image_cache import image_cache
 from utils.logger import logger, request_logger
+from utils import metrics, profiler, tracing
+
+
+# Built by the first sync job and reused, so the workers database (and its
+# cache) and the API clients carry over from one cycle to the next
+_processor: Optional[EventProcessor] = None
 
 
 def run_sync_job():
     """Run the synchronization job"""
+    global _processor
     try:
         logger.info("Starting sync job...")
-        processor = EventProcessor()
-        processor.process_events()
+        if _processor is None:
+            _processor = EventProcessor()
+        with profiler.profile_cycle():
+            _processor.process_events()
         logger.info("Sync job completed")
     except Exception as e:
         logger.error(f"Error in sync job: {e}")
+    
+    if not Config.DASHBOARD_IN_PROCESS:
+        # The separately running dashboard serves this process's metrics and traces from snapshots
+        try:
+            metrics.registry.write_snapshot(Config.METRICS_SNAPSHOT_PATH)
+            tracing.buffer.write_snapshot(Config.TRACES_SNAPSHOT_PATH)
+        except Exception as e:
+            logger.error(f"Error writing metrics snapshot: {e}")
 
 
 def run_cleanup_job():
-    """Run periodic cleanup of old logs"""
+    """Run periodic cleanup of old logs and cached images"""
     try:
         logger.info("Running cleanup job...")
         request_logger.cleanup_old_logs()
+        if Config.IMAGE_CACHE_ENABLED:
+            image_cache.prune()
         logger.info("Cleanup job completed")
     except Exception as e:
         logger.error(f"Error in cleanup job: {e}")
@@ -75,13 +96,16 @@ def main():
         logger.info(f"Data Directory: {Config.DATA_DIR.absolute()}")
         logger.info("=" * 60)
         
-        # Start dashboard in separate thread
-        dashboard_thread = threading.Thread(target=start_dashboard, daemon=True)
-        dashboard_thread.start()
-        
-        # Wait a moment for dashboard to start
-        time.sleep(2)
-        logger.info("Dashboard started successfully")
+        if Config.DASHBOARD_IN_PROCESS:
+            # Start dashboard in separate thread
+            dashboard_thread = threading.Thread(target=start_dashboard, daemon=True)
+            dashboard_thread.start()
+            
+            # Wait a moment for dashboard to start
+            time.sleep(2)
+            logger.info("Dashboard started successfully")
+        else:
+            logger.info("Dashboard runs in its own processes (wsgi.py)")
         
         # Start scheduler in main thread
         start_scheduler()
@@ -1,14 +1,26 @@
 """
 Event processing logic for worker synchronization
 """
+import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
+import numpy as np
 from api.supabase_api import SupabaseAPI
 from api.hikcentral_api import HikCentralAPI
-from database import WorkersDatabase
-from processors.image_processor import ImageProcessor
+from database import open_workers_database
+from config import Config
+from processors.face_store import face_store
+from processors.image_processor import ImageProcessor, flush_image_writes
+from utils.image_cache import image_cache
 from utils.logger import logger
+from utils import metrics, tracing
+
+
+# SHA-256 of known face photos -> national ID; filled by load_face_store and,
+# like face_store, shared by the processors of all sync jobs in this process
+_face_hashes: Dict[str, str] = {}
 
 
 class EventProcessor:
@@ -17,14 +29,18 @@ class EventProcessor:
     def __init__(self):
         self.supabase = SupabaseAPI()
         self.hikcentral = HikCentralAPI()
-        self.workers_db = WorkersDatabase()
+        self.workers_db = open_workers_database()
         self.image_processor = ImageProcessor()
+        # Worker record writes held back during a bulk event (see _deferred_worker_writes)
+        self._deferred_writes: Optional[Dict[str, list]] = None
     
     def process_events(self):
         """Main processing loop - fetch and process pending events"""
+        started = time.perf_counter()
         try:
             logger.info("Fetching pending events...")
             events = self.supabase.get_pending_events()
+            metrics.sync_backlog.set(len(events or []))
             
             if not events:
                 logger.info("No pending events to process")
@@ -33,10 +49,21 @@ class EventProcessor:
             logger.info(f"Processing {len(events)} events")
             
             for event in events:
-                self.process_single_event(event)
+                with tracing.trace_event(event.get('id', 'unknown'), event.get('type')):
+                    self.process_single_event(event)
+            
+            # Persist index cells of faces added or removed in this cycle
+            face_store.save_index()
+            # Images downloaded this cycle are on disk before the next one
+            flush_image_writes()
+            image_cache.save()
         
         except Exception as e:
             logger.error(f"Error processing events: {e}")
+        
+        finally:
+            metrics.sync_cycle_seconds.observe(time.perf_counter() - started)
+            metrics.sync_last_cycle.set(time.time())
     
     def process_single_event(self, event: Dict):
         """
@@ -60,8 +87,7 @@ class EventProcessor:
                 
                 if workers:
                     logger.info(f"Processing {len(workers)} workers from event")
-                    for worker in workers:
-                        self.handle_worker_created(worker)
+                    self.handle_workers_created(workers)
                 elif event_data:
                     self.handle_worker_created(event_data)
                 else:
@@ -73,16 +99,16 @@ class EventProcessor:
                     workers = event.get('workers', [])
                 
                 logger.info(f"Processing {len(workers)} workers in bulk")
-                for worker in workers:
-                    self.handle_worker_created(worker)
+                self.handle_workers_created(workers)
             
             elif event_type == 'worker.blocked':
                 workers = event.get('workers', [])
                 event_data = event.get('data', {})
                 
                 if workers:
-                    for worker in workers:
-                        self.handle_worker_blocked(worker)
+                    with self._deferred_worker_writes():
+                        for worker in workers:
+                            self.handle_worker_blocked(worker)
                 elif event_data:
                     self.handle_worker_blocked(event_data)
             
@@ -91,8 +117,9 @@ class EventProcessor:
                 if not workers:
                     workers = event.get('workers', [])
                 
-                for worker in workers:
-                    self.handle_worker_blocked(worker)
+                with self._deferred_worker_writes():
+                    for worker in workers:
+                        self.handle_worker_blocked(worker)
             
             elif event_type == 'worker.deleted' or \
                  event_type == 'user.expired_workers_deleted' or \
@@ -101,8 +128,9 @@ class EventProcessor:
                 event_data = event.get('data', {})
                 
                 if workers:
-                    for worker in workers:
-                        self.handle_worker_deleted(worker)
+                    with self._deferred_worker_writes():
+                        for worker in workers:
+                            self.handle_worker_deleted(worker)
                 elif event_data:
                     self.handle_worker_deleted(event_data)
             
@@ -111,8 +139,9 @@ class EventProcessor:
                 event_data = event.get('data', {})
                 
                 if workers:
-                    for worker in workers:
-                        self.handle_worker_unblocked(worker)
+                    with self._deferred_worker_writes():
+                        for worker in workers:
+                            self.handle_worker_unblocked(worker)
                 elif event_data:
                     self.handle_worker_unblocked(event_data)
             
@@ -121,17 +150,176 @@ class EventProcessor:
                 if not workers:
                     workers = event.get('workers', [])
                 
-                for worker in workers:
-                    self.handle_worker_unblocked(worker)
+                with self._deferred_worker_writes():
+                    for worker in workers:
+                        self.handle_worker_unblocked(worker)
             
             else:
                 logger.warning(f"Unknown event type: {event_type}")
+                metrics.events_processed.inc(type='unknown', result='ignored')
+                return
+            
+            metrics.events_processed.inc(type=event_type, result='ok')
         
         except Exception as e:
             logger.error(f"Error processing event {event_type} (ID: {event_id}): {e}", exc_info=True)
+            metrics.events_processed.inc(type=event_type, result='error')
+            tracing.set_error(str(e))
+    
+    @contextmanager
+    def _deferred_worker_writes(self):
+        """
+        Hold back the worker record writes of a bulk event and commit them together
+        
+        The handlers make HikCentral and Supabase calls per worker; doing
+        them inside workers_db.batch() would hold the database write lock
+        (file lock or SQLite write transaction) across all those round
+        trips. Instead the records are collected and written in one short
+        batch at the end, also when a handler fails midway, so persons
+        already created in HikCentral are never lost from the database.
+        """
+        if self._deferred_writes is not None:
+            yield
+            return
+        
+        self._deferred_writes = {'upserts': [], 'updates': []}
+        try:
+            yield
+        finally:
+            writes, self._deferred_writes = self._deferred_writes, None
+            if writes['upserts'] or writes['updates']:
+                with tracing.span('db_write', records=len(writes['upserts']) + len(writes['updates'])):
+                    with self.workers_db.batch():
+                        self.workers_db.upsert_workers(writes['upserts'])
+                        self.workers_db.update_many(writes['updates'])
+    
+    def _save_worker(self, record: Dict):
+        """Insert or update a worker record (deferred during a bulk event)"""
+        if self._deferred_writes is not None:
+            self._deferred_writes['upserts'].append(record)
+        else:
+            self.workers_db.upsert_worker(record)
+    
+    def _update_worker(self, national_id: str, fields: Dict):
+        """Update fields of a worker record (deferred during a bulk event)"""
+        if self._deferred_writes is not None:
+            self._deferred_writes['updates'].append(({'nationalIdNumber': national_id}, fields))
+        else:
+            self.workers_db.update({'nationalIdNumber': national_id}, fields)
     
     def handle_worker_created(self, worker_data: Dict):
         """Handle worker creation event"""
+        with tracing.span('prepare', national_id=worker_data.get('nationalIdNumber')):
+            prepared = self._prepare_worker_creation(worker_data)
+        if not prepared:
+            return
+        
+        with tracing.span('worker', national_id=prepared['national_id']):
+            # A byte-identical photo of another worker is a duplicate without any face matching
+            duplicate_of = self._exact_duplicate(prepared)
+            if duplicate_of:
+                self._complete_worker_creation(prepared, None, [(duplicate_of, 1.0)])
+                return
+            
+            # Encode the new face once; the encoding is stored with the worker record
+            face_encoding = self._stored_encoding(prepared)
+            if face_encoding is None:
+                logger.info(f"Encoding face for worker: {prepared['national_id']}")
+                face_encoding = self.image_processor.get_face_encoding(self._face_source(prepared))
+            self._complete_worker_creation(prepared, face_encoding)
+    
+    def handle_workers_created(self, workers: List[Dict]):
+        """
+        Handle creation of a batch of workers
+        
+        Images are downloaded first, then all faces are encoded in parallel
+        across processes and checked for duplicates in one pass (including
+        against each other), then each worker goes through the sequential
+        HikCentral and database steps. All workers of the batch sharing a
+        face are blocked. Byte-identical photos are encoded only once, and
+        photos identical to a known worker's are not encoded at all.
+        
+        Args:
+            workers: Worker objects from the event
+        """
+        # Handled one by one, a repeated national ID found its first copy already
+        # stored; in a batch both would be prepared before any write, so keep the first
+        unique_workers = []
+        seen_ids = set()
+        for worker in workers:
+            national_id = worker.get('nationalIdNumber')
+            if national_id and national_id in seen_ids:
+                logger.warning(f"Skipping repeated worker in batch: {national_id}")
+                continue
+            seen_ids.add(national_id)
+            unique_workers.append(worker)
+        workers = unique_workers
+        
+        if len(workers) < 2:
+            for worker in workers:
+                self.handle_worker_created(worker)
+            return
+        
+        prepared_workers = []
+        for worker in workers:
+            with tracing.span('prepare', national_id=worker.get('nationalIdNumber')):
+                prepared = self._prepare_worker_creation(worker)
+            if prepared:
+                prepared_workers.append(prepared)
+        
+        if not prepared_workers:
+            return
+        
+        exact_duplicates = [self._exact_duplicate(p) for p in prepared_workers]
+        encodings = [
+            None if duplicate_of else self._stored_encoding(p)
+            for p, duplicate_of in zip(prepared_workers, exact_duplicates)
+        ]
+        
+        # Encode each distinct photo once
+        to_encode: Dict[str, List[int]] = {}
+        for i, prepared in enumerate(prepared_workers):
+            if exact_duplicates[i] or encodings[i] is not None:
+                continue
+            to_encode.setdefault(prepared.get('face_sha256') or str(i), []).append(i)
+        
+        logger.info(f"Encoding {len(to_encode)} faces in parallel")
+        new_encodings = self.image_processor.encode_faces(
+            [self._face_source(prepared_workers[indices[0]]) for indices in to_encode.values()]
+        )
+        for indices, face_encoding in zip(to_encode.values(), new_encodings):
+            for i in indices:
+                encodings[i] = face_encoding
+        
+        # One pass against known faces and within the batch itself
+        logger.info(f"Checking {len(prepared_workers)} faces for duplicates")
+        self.load_face_store()
+        batch_duplicates = self.image_processor.find_duplicate_faces_batch(
+            encodings,
+            [p['national_id'] for p in prepared_workers]
+        )
+        for i, duplicate_of in enumerate(exact_duplicates):
+            if duplicate_of:
+                batch_duplicates[i] = [(duplicate_of, 1.0)]
+        
+        # All worker records of the batch are committed in one write, after the API calls
+        with self._deferred_worker_writes():
+            for prepared, face_encoding, duplicates in zip(prepared_workers, encodings, batch_duplicates):
+                with tracing.span('worker', national_id=prepared['national_id']):
+                    self._complete_worker_creation(prepared, face_encoding, duplicates)
+    
+    def _prepare_worker_creation(self, worker_data: Dict) -> Optional[Dict]:
+        """
+        Validate a new worker and download its images
+        
+        Args:
+            worker_data: Worker object from the event
+        
+        Returns:
+            Dict with the worker data, IDs and local image paths (plus the face
+            bytes and file signature in the in-memory pipeline), or None if
+            the worker should not be created
+        """
         try:
             national_id = worker_data.get('nationalIdNumber')
             worker_id = worker_data.get('workerId') or worker_data.get('id')
@@ -169,48 +357,161 @@ class EventProcessor:
             face_path = str(Path(self.image_processor.faces_dir) / face_filename)
             id_card_path = str(Path(self.image_processor.id_cards_dir) / id_card_filename)
             
-            if not self.supabase.download_image(face_url, face_path):
-                logger.error(f"Failed to download face photo for worker: {national_id}")
-                return
-            
-            logger.info(f"Face photo downloaded: {face_path}")
-            
-            if id_card_url:
-                if self.supabase.download_image(id_card_url, id_card_path):
-                    logger.info(f"ID card downloaded: {id_card_path}")
-                else:
-                    logger.warning(f"Failed to download ID card for worker: {national_id}")
+            face_data = None
+            face_signature = None
+            face_sha256 = None
+            
+            if Config.FACE_PIPELINE_IN_MEMORY:
+                # Keep the bytes for decoding and upload; files are written in the background
+                face_data = self.supabase.fetch_image(face_url)
+                if face_data is None:
+                    logger.error(f"Failed to download face photo for worker: {national_id}")
+                    return
+                face_signature = self.image_processor.save_image_async(face_data, face_path)
+                face_sha256 = image_cache.content_hash(face_data)
+                logger.info(f"Face photo downloaded ({len(face_data)} bytes), saving to: {face_path}")
+                
+                if id_card_url:
+                    id_card_data = self.supabase.fetch_image(id_card_url)
+                    if id_card_data is not None:
+                        self.image_processor.save_image_async(id_card_data, id_card_path)
+                        logger.info(f"ID card downloaded, saving to: {id_card_path}")
+                    else:
+                        logger.warning(f"Failed to download ID card for worker: {national_id}")
+            else:
+                if not self.supabase.download_image(face_url, face_path):
+                    logger.error(f"Failed to download face photo for worker: {national_id}")
+                    return
+                
+                logger.info(f"Face photo downloaded: {face_path}")
+                if Config.IMAGE_CACHE_ENABLED:
+                    face_sha256 = image_cache.url_hash(face_url)
+                
+                if id_card_url:
+                    if self.supabase.download_image(id_card_url, id_card_path):
+                        logger.info(f"ID card downloaded: {id_card_path}")
+                    else:
+                        logger.warning(f"Failed to download ID card for worker: {national_id}")
+            
+            return {
+                'worker_data': worker_data,
+                'national_id': national_id,
+                'worker_id': worker_id,
+                'face_path': face_path,
+                'face_data': face_data,
+                'face_signature': face_signature,
+                'face_sha256': face_sha256,
+                'existing': existing,
+                'id_card_path': id_card_path,
+                'id_card_url': id_card_url
+            }
+        
+        except Exception as e:
+            logger.error(f"Error preparing worker creation: {e}", exc_info=True)
+            return None
+    
+    @staticmethod
+    def _face_source(prepared: Dict):
+        """Face image to encode for a prepared worker: its bytes if kept in memory, else its path"""
+        if prepared.get('face_data') is not None:
+            return memoryview(prepared['face_data'])
+        return prepared['face_path']
+    
+    def _exact_duplicate(self, prepared: Dict) -> Optional[str]:
+        """National ID of another known worker whose face photo has the same bytes"""
+        face_sha256 = prepared.get('face_sha256')
+        if not face_sha256:
+            return None
+        
+        self.load_face_store()
+        owner = _face_hashes.get(face_sha256)
+        if not owner or owner == prepared['national_id']:
+            return None
+        
+        logger.warning(
+            f"Face photo of worker {prepared['national_id']} is byte-identical to "
+            f"worker {owner}'s, skipping face encoding"
+        )
+        return owner
+    
+    def _stored_encoding(self, prepared: Dict) -> Optional[np.ndarray]:
+        """Encoding stored for this worker's identical face photo (re-sent or retried events)"""
+        existing = prepared.get('existing')
+        face_sha256 = prepared.get('face_sha256')
+        if not existing or not face_sha256 or existing.get('face_sha256') != face_sha256:
+            return None
+        if not existing.get('face_encoding'):
+            return None
+        
+        logger.info(f"Face photo unchanged, reusing stored encoding for worker: {prepared['national_id']}")
+        return self.image_processor.encoding_from_str(existing['face_encoding'])
+    
+    def _complete_worker_creation(
+        self,
+        prepared: Dict,
+        face_encoding: Optional[np.ndarray],
+        duplicates: Optional[List[Tuple[str, float]]] = None
+    ):
+        """
+        Check a prepared worker for duplicates and create it in HikCentral
+        
+        Args:
+            prepared: Result of _prepare_worker_creation
+            face_encoding: Encoding of the worker's face (None if no face was found)
+            duplicates: Precomputed duplicate matches (batch path); searched here if None
+        """
+        try:
+            worker_data = prepared['worker_data']
+            national_id = prepared['national_id']
+            worker_id = prepared['worker_id']
+            face_path = prepared['face_path']
+            id_card_path = prepared['id_card_path']
+            id_card_url = prepared['id_card_url']
+            
+            face_sha256 = prepared.get('face_sha256') or ''
+            encoding_fields = self.image_processor.encoding_fields(
+                face_path,
+                face_encoding,
+                signature=prepared.get('face_signature')
+            )
+            encoding_fields['face_sha256'] = face_sha256
             
             # Check for duplicate faces
-            logger.info(f"Checking for duplicate faces for worker: {national_id}")
-            existing_workers = self.workers_db.get_all_workers()
-            existing_face_paths = [
-                w.get('face_image_path')
-                for w in existing_workers
-                if w.get('face_image_path') and Path(w['face_image_path']).exists()
-            ]
-            
-            duplicates = self.image_processor.find_duplicate_faces(face_path, existing_face_paths)
-            
-            if duplicates:
-                logger.warning(
-                    f"Potential duplicate faces found for worker {national_id}. "
-                    f"Top match: {duplicates[0][0]} (similarity: {duplicates[0][1]:.2f})"
-                )
-                # Block worker due to potential fraud
-                self.supabase.update_worker_status(
-                    worker_id=worker_id,
-                    national_id_number=national_id,
-                    status='blocked',
-                    blocked_reason=f'وجه مطابق لعامل آخر - احتمال تزوير (تشابه: {duplicates[0][1]:.1%})'
-                )
-                return
-            
-            logger.info(f"No duplicate faces found for worker: {national_id}")
+            if face_encoding is None and not duplicates:
+                logger.warning(f"Could not extract face from new image: {face_path}")
+            else:
+                if duplicates is None:
+                    logger.info(f"Checking for duplicate faces for worker: {national_id}")
+                    self.load_face_store()
+                    duplicates = self.image_processor.find_duplicate_faces(
+                        face_encoding,
+                        exclude_national_id=national_id
+                    )
+                
+                if duplicates:
+                    logger.warning(
+                        f"Potential duplicate faces found for worker {national_id}. "
+                        f"Top match: worker {duplicates[0][0]} (similarity: {duplicates[0][1]:.2f})"
+                    )
+                    # Block worker due to potential fraud
+                    with tracing.span('status_update', status='blocked'):
+                        self.supabase.update_worker_status(
+                            worker_id=worker_id,
+                            national_id_number=national_id,
+                            status='blocked',
+                            blocked_reason=f'وجه مطابق لعامل آخر - احتمال تزوير (تشابه: {duplicates[0][1]:.1%})'
+                        )
+                    return
+                
+                logger.info(f"No duplicate faces found for worker: {national_id}")
             
             # Convert face image to base64
             logger.info(f"Converting face image to base64 for worker: {national_id}")
-            face_base64 = self.image_processor.image_to_base64(face_path)
+            with tracing.span('base64'):
+                if prepared.get('face_data') is not None:
+                    face_base64 = self.image_processor.bytes_to_base64(prepared['face_data'])
+                else:
+                    face_base64 = self.image_processor.image_to_base64(face_path)
             if not face_base64:
                 logger.error(f"Failed to convert face image to base64: {national_id}")
                 return
@@ -268,17 +569,18 @@ class EventProcessor:
             # Add person to HikCentral
             logger.info(f"Adding person to HikCentral: {national_id} (Worker ID: {worker_id})")
             logger.info(f"Date range: {begin_time} to {end_time}")
-            person_id = self.hikcentral.add_person(
-                person_code=worker_id,  # Use worker.id from Supabase (e.g., "25165168156010")
-                family_name=family_name,
-                given_name=given_name,
-                gender=1,  # Male by default
-                phone_no=worker_data.get('phoneNumber', ''),
-                email=worker_data.get('email', ''),
-                face_data=face_base64,
-                begin_time=begin_time,
-                end_time=end_time
-            )
+            with tracing.span('add_person'):
+                person_id = self.hikcentral.add_person(
+                    person_code=worker_id,  # Use worker.id from Supabase (e.g., "25165168156010")
+                    family_name=family_name,
+                    given_name=given_name,
+                    gender=1,  # Male by default
+                    phone_no=worker_data.get('phoneNumber', ''),
+                    email=worker_data.get('email', ''),
+                    face_data=face_base64,
+                    begin_time=begin_time,
+                    end_time=end_time
+                )
             
             logger.info(f"HikCentral add_person returned: {person_id}")
             
@@ -286,19 +588,24 @@ class EventProcessor:
                 logger.error(f"Failed to add person to HikCentral: {national_id}")
                 # Still save to local database with pending status
                 logger.info(f"Saving worker to local database with pending status: {national_id}")
-                self.workers_db.upsert_worker({
-                    'workerId': worker_id,
-                    'nationalIdNumber': national_id,
-                    'fullName': full_name,
-                    'phoneNumber': worker_data.get('phoneNumber', ''),
-                    'email': worker_data.get('email', ''),
-                    'status': 'pending',
-                    'hikcentral_person_id': '',
-                    'face_image_path': face_path,
-                    'id_card_image_path': id_card_path if id_card_url else '',
-                    'has_privilege_access': False,
-                    'created_at': datetime.utcnow().isoformat()
-                })
+                with tracing.span('db_upsert'):
+                    self._save_worker({
+                        'workerId': worker_id,
+                        'nationalIdNumber': national_id,
+                        'fullName': full_name,
+                        'phoneNumber': worker_data.get('phoneNumber', ''),
+                        'email': worker_data.get('email', ''),
+                        'status': 'pending',
+                        'hikcentral_person_id': '',
+                        'face_image_path': face_path,
+                        'id_card_image_path': id_card_path if id_card_url else '',
+                        'has_privilege_access': False,
+                        'created_at': datetime.utcnow().isoformat(),
+                        **encoding_fields
+                    })
+                    if face_encoding is not None:
+                        face_store.add(national_id, face_encoding, worker_id, 'pending')
+                self._remember_face_hash(face_sha256, national_id)
                 logger.info(f"Worker saved to local database: {national_id}")
                 return
             
@@ -306,7 +613,8 @@ class EventProcessor:
             
             # Add to privilege group (grant access)
             logger.info(f"Adding person to privilege group: {national_id}")
-            privilege_result = self.hikcentral.add_to_privilege_group(person_id)
+            with tracing.span('privilege_grant'):
+                privilege_result = self.hikcentral.add_to_privilege_group(person_id)
             logger.info(f"Privilege group result: {privilege_result}")
             
             if not privilege_result:
@@ -327,27 +635,81 @@ class EventProcessor:
                 'face_image_path': face_path,
                 'id_card_image_path': id_card_path if id_card_url else '',
                 'has_privilege_access': True,
-                'created_at': datetime.utcnow().isoformat()
+                'created_at': datetime.utcnow().isoformat(),
+                **encoding_fields
             }
-            logger.info(f"Worker record prepared: {worker_record}")
+            logger.info(f"Worker record prepared: {worker_id} ({national_id})")
             
-            self.workers_db.upsert_worker(worker_record)
+            with tracing.span('db_upsert'):
+                self._save_worker(worker_record)
+                if face_encoding is not None:
+                    face_store.add(national_id, face_encoding, worker_id, 'approved')
+            self._remember_face_hash(face_sha256, national_id)
             logger.info(f"Worker saved to local database successfully: {national_id}")
             
             # Update status in online application
             logger.info(f"Updating worker status in Supabase: {national_id}")
-            self.supabase.update_worker_status(
-                worker_id=worker_id,
-                national_id_number=national_id,
-                status='approved',
-                external_id=person_id
-            )
+            with tracing.span('status_update', status='approved'):
+                self.supabase.update_worker_status(
+                    worker_id=worker_id,
+                    national_id_number=national_id,
+                    status='approved',
+                    external_id=person_id
+                )
             
             logger.info(f"✓ Successfully created worker in HikCentral: {national_id} (Person ID: {person_id})")
         
         except Exception as e:
             logger.error(f"Error handling worker creation: {e}", exc_info=True)
     
+    def load_face_store(self, reload: bool = False):
+        """
+        Load stored face encodings of existing workers into the face store
+        
+        Runs once per process (unless reload is set) and rewrites the shared
+        encoding file. Workers whose image changed since it was encoded (or
+        that were never encoded) are re-encoded here and the result is
+        persisted, so each image is only encoded once. Deleted workers are
+        left out; blocked workers stay searchable.
+        
+        Args:
+            reload: Load again even if already loaded
+        """
+        if face_store.loaded and not reload:
+            return
+        
+        entries = []
+        refreshed = {}
+        face_hashes = {}
+        
+        for worker in self.workers_db.get_all_workers():
+            if worker.get('status') == 'deleted':
+                continue
+            
+            encoding, fields = self.image_processor.get_worker_encoding(worker)
+            national_id = worker.get('nationalIdNumber')
+            if fields:
+                refreshed[national_id] = fields
+            if encoding is not None:
+                entries.append((national_id, encoding, worker.get('workerId', ''), worker.get('status', '')))
+            # The photo hash is only trusted while the image file is unchanged
+            if worker.get('face_sha256') and not fields:
+                face_hashes[worker['face_sha256']] = national_id
+        
+        if refreshed:
+            self.workers_db.set_face_encodings(refreshed)
+            logger.info(f"Stored refreshed face encodings for {len(refreshed)} workers")
+        
+        face_store.load(entries)
+        _face_hashes.clear()
+        _face_hashes.update(face_hashes)
+        logger.info(f"Loaded {len(face_store)} face encodings into face store")
+    
+    def _remember_face_hash(self, face_sha256: str, national_id: str):
+        """Register a saved worker's face photo hash for exact duplicate checks"""
+        if face_sha256 and face_store.loaded:
+            _face_hashes[face_sha256] = national_id
+    
     def handle_worker_blocked(self, worker_data: Dict):
         """Handle worker blocking event"""
         try:
@@ -371,8 +733,8 @@ class EventProcessor:
             # Remove from privilege group (revoke access)
             if self.hikcentral.remove_from_privilege_group(person_id):
                 # Update local database
-                self.workers_db.update(
-                    {'nationalIdNumber': national_id},
+                self._update_worker(
+                    national_id,
                     {
                         'status': 'blocked',
                         'blockedReason': blocked_reason,
@@ -380,6 +742,7 @@ class EventProcessor:
                         'blocked_at': datetime.utcnow().isoformat()
                     }
                 )
+                face_store.set_status(national_id, 'blocked')
                 
                 logger.info(f"Successfully blocked worker: {national_id}")
             else:
@@ -409,13 +772,16 @@ class EventProcessor:
             # Delete from HikCentral
             if self.hikcentral.delete_person(person_id):
                 # Update local database (mark as deleted but keep history)
-                self.workers_db.update(
-                    {'nationalIdNumber': national_id},
+                self._update_worker(
+                    national_id,
                     {
                         'status': 'deleted',
                         'deleted_at': datetime.utcnow().isoformat()
                     }
                 )
+                face_store.remove(national_id)
+                if _face_hashes.get(worker.get('face_sha256')) == national_id:
+                    del _face_hashes[worker['face_sha256']]
                 
                 logger.info(f"Successfully deleted worker: {national_id}")
             else:
@@ -446,8 +812,8 @@ class EventProcessor:
             # Add back to privilege group (restore access)
             if self.hikcentral.add_to_privilege_group(person_id):
                 # Update local database
-                self.workers_db.update(
-                    {'nationalIdNumber': national_id},
+                self._update_worker(
+                    national_id,
                     {
                         'status': 'approved',
                         'blockedReason': '',
@@ -455,6 +821,7 @@ class EventProcessor:
                         'unblocked_at': datetime.utcnow().isoformat()
                     }
                 )
+                face_store.set_status(national_id, 'approved')
                 
                 # Update status in online application
                 self.supabase.update_worker_status(
@@ -0,0 +1,225 @@
+"""
+Approximate nearest-neighbour index for face encodings (IVF / k-means partitioning)
+"""
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class IVFFaceIndex:
+    """
+    Inverted-file index over rows of a FaceEncodingStore
+    
+    Encodings are partitioned into ``nlist`` k-means cells. A lookup only
+    scans the rows of the ``nprobe`` cells closest to the query, so the
+    candidate set is roughly N * nprobe / nlist; raising nprobe trades
+    latency for recall. The index only holds row numbers, the vectors stay
+    in the store and candidates are re-ranked exactly there.
+    """
+    
+    KMEANS_ITERATIONS = 12
+    SAMPLES_PER_LIST = 256
+    ASSIGN_CHUNK = 8192
+    
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._list_sizes: Optional[np.ndarray] = None
+        self._row_list = np.full(0, -1, dtype=np.int32)
+        self._row_pos = np.full(0, -1, dtype=np.int32)
+        self.trained_size = 0
+    
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+    
+    @property
+    def nlist(self) -> int:
+        return 0 if self.centroids is None else len(self.centroids)
+    
+    @staticmethod
+    def auto_nlist(size: int) -> int:
+        """Default number of cells for a population (about sqrt(N))"""
+        return max(16, int(np.sqrt(max(size, 1))))
+    
+    def train(self, vectors: np.ndarray, nlist: int, seed: int = 0):
+        """
+        Compute cell centroids with k-means on a sample of vectors
+        
+        Args:
+            vectors: Live encodings (N x dim)
+            nlist: Number of cells
+            seed: Random seed for sampling and initialisation
+        """
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist, len(vectors)))
+        sample_size = min(len(vectors), nlist * self.SAMPLES_PER_LIST)
+        sample = np.ascontiguousarray(
+            vectors[rng.choice(len(vectors), sample_size, replace=False)],
+            dtype=np.float32
+        )
+        
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERATIONS):
+            assignment = self._nearest(sample, centroids)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            # Per-cell sums over the sample sorted by cell
+            order = np.argsort(assignment, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids[~empty] = sums / counts[~empty, None].astype(np.float32)
+            # Re-seed empty cells from random samples
+            if empty.any():
+                centroids[empty] = sample[rng.choice(sample_size, int(empty.sum()), replace=False)]
+        
+        self.centroids = centroids
+        self.trained_size = len(vectors)
+        self.clear()
+    
+    def _nearest(self, vectors: np.ndarray, centroids: np.ndarray, nprobe: int = 1) -> np.ndarray:
+        """Indices of the nprobe nearest centroids per vector (chunked)"""
+        c_norms = np.einsum('ij,ij->i', centroids, centroids)
+        results = []
+        for start in range(0, len(vectors), self.ASSIGN_CHUNK):
+            chunk = vectors[start:start + self.ASSIGN_CHUNK]
+            # ||c||^2 - 2 x.c is enough to rank centroids for a fixed x
+            scores = c_norms[None, :] - 2.0 * (chunk @ centroids.T)
+            if nprobe == 1:
+                results.append(np.argmin(scores, axis=1))
+            else:
+                results.append(np.argpartition(scores, nprobe - 1, axis=1)[:, :nprobe])
+        if not results:
+            return np.zeros(0 if nprobe == 1 else (0, nprobe), dtype=np.int64)
+        return np.concatenate(results)
+    
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Cell number for each vector"""
+        return self._nearest(np.asarray(vectors, dtype=np.float32), self.centroids).astype(np.int32)
+    
+    def clear(self):
+        """Empty all cells, keeping the centroids"""
+        self._lists = [np.zeros(16, dtype=np.int32) for _ in range(self.nlist)]
+        self._list_sizes = np.zeros(self.nlist, dtype=np.int64)
+        self._row_list = np.full(0, -1, dtype=np.int32)
+        self._row_pos = np.full(0, -1, dtype=np.int32)
+    
+    def _ensure_rows(self, row: int):
+        """Grow the row -> cell maps to hold row"""
+        if row < len(self._row_list):
+            return
+        capacity = max(1024, len(self._row_list))
+        while capacity <= row:
+            capacity *= 2
+        for name in ('_row_list', '_row_pos'):
+            old = getattr(self, name)
+            new = np.full(capacity, -1, dtype=np.int32)
+            new[:len(old)] = old
+            setattr(self, name, new)
+    
+    def add(self, row: int, cell: int):
+        """Insert a store row into a cell"""
+        self._ensure_rows(row)
+        if self._row_list[row] >= 0:
+            self.remove(row)
+        
+        members = self._lists[cell]
+        size = self._list_sizes[cell]
+        if size == len(members):
+            members = np.concatenate([members, np.zeros(len(members), dtype=np.int32)])
+            self._lists[cell] = members
+        members[size] = row
+        self._list_sizes[cell] = size + 1
+        self._row_list[row] = cell
+        self._row_pos[row] = size
+    
+    def add_many(self, rows: np.ndarray, cells: np.ndarray):
+        """Insert many store rows at once"""
+        for row, cell in zip(rows.tolist(), cells.tolist()):
+            self.add(row, cell)
+    
+    def remove(self, row: int) -> bool:
+        """Remove a store row from its cell (swap with the cell's last member)"""
+        if row >= len(self._row_list) or self._row_list[row] < 0:
+            return False
+        
+        cell = self._row_list[row]
+        pos = self._row_pos[row]
+        last = self._list_sizes[cell] - 1
+        members = self._lists[cell]
+        moved = members[last]
+        members[pos] = moved
+        self._row_pos[moved] = pos
+        self._list_sizes[cell] = last
+        self._row_list[row] = -1
+        self._row_pos[row] = -1
+        return True
+    
+    def row_cells(self, count: int) -> np.ndarray:
+        """Cell of each of the first count rows (-1 if not indexed)"""
+        cells = np.full(count, -1, dtype=np.int32)
+        n = min(count, len(self._row_list))
+        cells[:n] = self._row_list[:n]
+        return cells
+    
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """
+        Rows in the nprobe cells nearest to the query
+        
+        Args:
+            query: Face encoding
+            nprobe: Number of cells to scan
+        
+        Returns:
+            Array of store rows
+        """
+        nprobe = max(1, min(nprobe, self.nlist))
+        cells = self._nearest(query.reshape(1, -1), self.centroids, nprobe).reshape(-1)
+        parts = [self._lists[c][:self._list_sizes[c]] for c in cells]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32)
+    
+    def save(self, path: Path, keys: List[str], cells: np.ndarray):
+        """
+        Persist centroids and the cell of each key
+        
+        Args:
+            path: Target .npz file
+            keys: Key of each live row
+            cells: Cell of each live row (same order as keys)
+        """
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                trained_size=np.int64(self.trained_size),
+                keys=np.array(keys, dtype=str),
+                cells=np.asarray(cells, dtype=np.int32)
+            )
+        tmp_path.replace(path)
+    
+    def load(self, path: Path) -> Optional[Dict[str, int]]:
+        """
+        Load persisted centroids
+        
+        Args:
+            path: .npz file written by save
+        
+        Returns:
+            Mapping of key -> cell, or None if the file is missing or unusable
+        """
+        if not path.exists():
+            return None
+        
+        with np.load(path) as data:
+            centroids = data['centroids'].astype(np.float32)
+            if centroids.ndim != 2 or centroids.shape[1] != self.dim:
+                return None
+            self.centroids = centroids
+            self.trained_size = int(data['trained_size'])
+            keys = data['keys'].tolist()
+            cells = data['cells'].tolist()
+        
+        self.clear()
+        return dict(zip(keys, cells))
@@ -0,0 +1,571 @@
+"""
+Shared store of known face encodings for vectorized duplicate search
+
+Encodings live in a fixed-record binary file under Config.DATA_DIR that is
+memory-mapped with NumPy. The sync process is the only writer; any other
+process (e.g. the dashboard) can open the same file read-only with
+FaceEncodingReader and search it zero-copy.
+
+File layout:
+    header  64 bytes (HEADER_DTYPE)
+    records capacity x RECORD_DTYPE: alive flag, status code, squared
+            norm, national ID, worker ID and the float32 encoding
+
+Only rows below the header count are valid. An append writes the record
+first and then bumps the count, a delete clears the alive byte, so readers
+never see a half-written row. Rebuilds write a new file and os.replace it.
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from config import Config
+from processors.face_index import IVFFaceIndex
+from utils.logger import logger
+from utils.metrics import face_dedup_scan_size
+
+
+MAGIC = b'HPFACE01'
+FILE_VERSION = 1
+DIM = 128
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('dim', '<u4'),
+    ('capacity', '<u8'),
+    ('count', '<u8'),
+    ('generation', '<u8'),
+    ('reserved', 'V24'),
+])
+
+RECORD_DTYPE = np.dtype([
+    ('alive', 'u1'),
+    ('status', 'u1'),
+    ('reserved', 'V2'),
+    ('sq_norm', '<f4'),
+    ('national_id', 'S32'),
+    ('worker_id', 'S40'),
+    ('vector', '<f4', (DIM,)),
+])
+
+STATUS_CODES = {'': 0, 'pending': 1, 'approved': 2, 'blocked': 3, 'deleted': 4}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+def _encode_key(value: str, size: int) -> bytes:
+    """Encode an ID for a fixed-width record field"""
+    encoded = (value or '').encode('utf-8')
+    if len(encoded) > size:
+        raise ValueError(f"ID too long for face encoding file ({len(encoded)} > {size} bytes): {value}")
+    return encoded
+
+
+def _fits_record(key: str, worker_id: str) -> bool:
+    """Whether the IDs fit the record fields (logs and returns False otherwise)"""
+    try:
+        _encode_key(key, 32)
+        _encode_key(worker_id, 40)
+        return True
+    except ValueError as e:
+        logger.warning(f"Skipping face encoding: {e}")
+        return False
+
+
+def _write_file(path: Path, records: np.ndarray, capacity: int, generation: int):
+    """Write a complete encoding file atomically (temp file + os.replace)"""
+    tmp_path = path.with_name(path.name + '.tmp')
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = FILE_VERSION
+    header['dim'] = DIM
+    header['capacity'] = capacity
+    header['count'] = len(records)
+    header['generation'] = generation
+    
+    with open(tmp_path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(records.tobytes())
+        f.truncate(HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _map_file(path: Path, mode: str) -> Tuple[np.memmap, np.memmap]:
+    """Memory-map the header and records of an encoding file"""
+    header = np.memmap(path, dtype=HEADER_DTYPE, mode=mode, shape=(1,))
+    if header['magic'][0] != MAGIC or header['dim'][0] != DIM:
+        raise ValueError(f"Not a face encoding file: {path}")
+    capacity = int(header['capacity'][0])
+    records = np.memmap(path, dtype=RECORD_DTYPE, mode=mode, offset=HEADER_DTYPE.itemsize, shape=(capacity,))
+    return header, records
+
+
+def _row_distances(records: np.ndarray, rows, query: np.ndarray) -> np.ndarray:
+    """Euclidean distance from query to the given rows (dead rows are inf)"""
+    # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2, one matrix-vector product
+    sq = records['sq_norm'][rows] - 2.0 * (records['vector'][rows] @ query) + float(np.dot(query, query))
+    np.maximum(sq, 0.0, out=sq)
+    distances = np.sqrt(sq)
+    distances[records['alive'][rows] == 0] = np.inf
+    return distances
+
+
+def _top_matches(
+    records: np.ndarray,
+    rows: np.ndarray,
+    distances: np.ndarray,
+    k: int,
+    threshold: float
+) -> List[Tuple[str, str, str, float]]:
+    """Select the k best rows within the threshold and describe them"""
+    if len(rows) == 0:
+        return []
+    k = min(k, len(rows))
+    top = np.argpartition(distances, k - 1)[:k]
+    top = top[np.argsort(distances[top])]
+    
+    max_distance = 1.0 - threshold
+    results = []
+    for i, row in zip(top.tolist(), rows[top].tolist()):
+        if distances[i] > max_distance:
+            break
+        record = records[row]
+        results.append((
+            record['national_id'].decode('utf-8'),
+            record['worker_id'].decode('utf-8'),
+            STATUS_NAMES.get(int(record['status']), ''),
+            float(1.0 - distances[i])
+        ))
+    return results
+
+
+class FaceEncodingStore:
+    """Memory-mapped N x 128 float32 matrix of known face encodings keyed by national ID"""
+    
+    INITIAL_CAPACITY = 1024
+    SEARCH_CHUNK = 16384
+    
+    def __init__(self, path: Optional[Path] = None):
+        self.dim = DIM
+        self.path = path
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.index = IVFFaceIndex(DIM)
+        self._index_dirty = False
+        self._header: Optional[np.memmap] = None
+        self._records: Optional[np.memmap] = None
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._count = 0
+    
+    def _file_path(self) -> Path:
+        return self.path or Config.FACE_ENCODINGS_PATH
+    
+    def __len__(self) -> int:
+        return len(self._rows)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+    
+    def _open(self):
+        """Map the encoding file and rebuild the in-memory key map (caller holds the lock)"""
+        self._header, self._records = _map_file(self._file_path(), 'r+')
+        self._count = int(self._header['count'][0])
+        self._keys = [key.decode('utf-8') for key in self._records['national_id'][:self._count]]
+        alive = self._records['alive'][:self._count]
+        self._rows = {key: row for row, key in enumerate(self._keys) if alive[row]}
+    
+    def _rewrite(self, records: np.ndarray):
+        """Replace the encoding file with the given records (caller holds the lock)"""
+        generation = int(self._header['generation'][0]) + 1 if self._header is not None else 1
+        capacity = self.INITIAL_CAPACITY
+        while capacity < len(records):
+            capacity *= 2
+        self._header = self._records = None
+        _write_file(self._file_path(), records, capacity, generation)
+        self._open()
+    
+    def _grow(self):
+        """Double the file capacity in place (caller holds the lock)"""
+        capacity = int(self._header['capacity'][0]) * 2
+        self._records.flush()
+        self._header = self._records = None
+        with open(self._file_path(), 'r+b') as f:
+            f.truncate(HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize)
+        header = np.memmap(self._file_path(), dtype=HEADER_DTYPE, mode='r+', shape=(1,))
+        header['capacity'] = capacity
+        header.flush()
+        self._header, self._records = _map_file(self._file_path(), 'r+')
+    
+    def _append(self, key: str, encoding: np.ndarray, worker_id: str, status: str) -> int:
+        """Append a row and publish it by bumping the count (caller holds the lock)"""
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        vector = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        record['alive'] = 1
+        record['status'] = STATUS_CODES.get(status, 0)
+        record['sq_norm'] = float(np.dot(vector, vector))
+        record['national_id'] = _encode_key(key, 32)
+        record['worker_id'] = _encode_key(worker_id, 40)
+        record['vector'] = vector
+        
+        existing = self._rows.pop(key, None)
+        if existing is not None:
+            self._records['alive'][existing] = 0
+            self.index.remove(existing)
+        
+        if self._count >= len(self._records):
+            self._grow()
+        row = self._count
+        self._records[row] = record[0]
+        self._records.flush()
+        self._count += 1
+        self._header['count'] = self._count
+        self._header.flush()
+        
+        self._keys.append(key)
+        self._rows[key] = row
+        
+        if self.index.is_trained and self._use_index():
+            self.index.add(row, int(self.index.assign(vector[None, :])[0]))
+            self._index_dirty = True
+        return row
+    
+    def _use_index(self) -> bool:
+        """Whether lookups should go through the IVF index"""
+        return Config.FACE_INDEX_ENABLED and len(self._rows) >= Config.FACE_INDEX_MIN_SIZE
+    
+    def _live_rows(self) -> np.ndarray:
+        return np.flatnonzero(self._records['alive'][:self._count])
+    
+    def _index_all_rows(self, known_cells: Optional[Dict[str, int]] = None):
+        """(Re)build the index cells for all live rows (caller holds the lock)"""
+        self.index.clear()
+        live = self._live_rows()
+        cells = np.full(len(live), -1, dtype=np.int32)
+        if known_cells:
+            for i, row in enumerate(live.tolist()):
+                cell = known_cells.get(self._keys[row], -1)
+                if 0 <= cell < self.index.nlist:
+                    cells[i] = cell
+        
+        missing = cells < 0
+        if missing.any():
+            cells[missing] = self.index.assign(self._records['vector'][live[missing]])
+        self.index.add_many(live, cells)
+        self._index_dirty = True
+    
+    def _maybe_train_index(self):
+        """Train the index once the population is large enough (caller holds the lock)"""
+        if not self._use_index():
+            return
+        # Retrain when the population has grown well past what the cells were fitted on
+        if self.index.is_trained and len(self._rows) < 4 * self.index.trained_size:
+            return
+        
+        live = self._live_rows()
+        nlist = Config.FACE_INDEX_NLIST or IVFFaceIndex.auto_nlist(len(live))
+        logger.info(f"Training face index: {len(live)} faces, {nlist} cells")
+        self.index.train(self._records['vector'][live], nlist)
+        self._index_all_rows()
+    
+    def load(self, entries: Iterable[Tuple[str, np.ndarray, str, str]]):
+        """
+        Replace the store contents (rewrites the encoding file)
+        
+        Args:
+            entries: Iterable of tuples (key, encoding, worker_id, status)
+        """
+        latest = {}
+        for key, encoding, worker_id, status in entries:
+            if _fits_record(key, worker_id):
+                latest[key] = (encoding, worker_id, status)
+        
+        records = np.zeros(len(latest), dtype=RECORD_DTYPE)
+        if latest:
+            vectors = np.array([encoding for encoding, _, _ in latest.values()], dtype=np.float32)
+            records['alive'] = 1
+            records['status'] = [STATUS_CODES.get(status, 0) for _, _, status in latest.values()]
+            records['sq_norm'] = np.einsum('ij,ij->i', vectors, vectors)
+            records['national_id'] = [_encode_key(key, 32) for key in latest]
+            records['worker_id'] = [_encode_key(worker_id, 40) for _, worker_id, _ in latest.values()]
+            records['vector'] = vectors
+        
+        with self.lock:
+            self._rewrite(records)
+            self.index = IVFFaceIndex(self.dim)
+            
+            if self._use_index():
+                try:
+                    known_cells = self.index.load(Config.FACE_INDEX_PATH)
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable face index {Config.FACE_INDEX_PATH}: {e}")
+                    self.index = IVFFaceIndex(self.dim)
+                    known_cells = None
+                if known_cells is not None:
+                    self._index_all_rows(known_cells)
+                self._maybe_train_index()
+            self.loaded = True
+    
+    def add(self, key: str, encoding: np.ndarray, worker_id: str = '', status: str = ''):
+        """
+        Add or replace the encoding for a key
+        
+        Ignored until the store is loaded; loading reads every worker from
+        the database anyway. IDs too long for the record fields are skipped.
+        
+        Args:
+            key: Worker national ID
+            encoding: 128-d face encoding
+            worker_id: Worker ID
+            status: Worker status
+        """
+        with self.lock:
+            if not self.loaded or not _fits_record(key, worker_id):
+                return
+            self._append(key, encoding, worker_id, status)
+            self._maybe_train_index()
+    
+    def set_status(self, key: str, status: str) -> bool:
+        """Update the worker status recorded for a key"""
+        with self.lock:
+            row = self._rows.get(key)
+            if row is None:
+                return False
+            self._records['status'][row] = STATUS_CODES.get(status, 0)
+            self._records.flush()
+            return True
+    
+    def remove(self, key: str) -> bool:
+        """
+        Remove the encoding for a key
+        
+        Rows are tombstoned and the file is compacted once more than half
+        of it is dead.
+        """
+        with self.lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                return False
+            self._records['alive'][row] = 0
+            self._records.flush()
+            if self.index.remove(row):
+                self._index_dirty = True
+            if self._count > self.INITIAL_CAPACITY and len(self._rows) < self._count // 2:
+                self._compact()
+            return True
+    
+    def _compact(self):
+        """Rewrite the file without dead rows (caller holds the lock)"""
+        live = self._live_rows()
+        cells = self.index.row_cells(self._count)[live]
+        self._rewrite(np.array(self._records[live]))
+        
+        if self.index.is_trained:
+            self.index.clear()
+            indexed = cells >= 0
+            self.index.add_many(np.flatnonzero(indexed), cells[indexed])
+            unindexed = np.flatnonzero(~indexed)
+            if len(unindexed):
+                self.index.add_many(unindexed, self.index.assign(self._records['vector'][unindexed]))
+            self._index_dirty = True
+    
+    def save_index(self):
+        """Persist the index cells if they changed since the last save"""
+        with self.lock:
+            if not self.index.is_trained or not self._index_dirty:
+                return
+            live = self._live_rows()
+            keys = [self._keys[row] for row in live.tolist()]
+            cells = self.index.row_cells(self._count)[live]
+            self._index_dirty = False
+        
+        try:
+            self.index.save(Config.FACE_INDEX_PATH, keys, cells)
+        except Exception as e:
+            logger.error(f"Failed to save face index: {e}")
+    
+    def search(
+        self,
+        encoding: np.ndarray,
+        threshold: float,
+        k: int = 10,
+        exclude_key: Optional[str] = None,
+        nprobe: Optional[int] = None
+    ) -> List[Tuple[str, str, str, float]]:
+        """
+        Find the most similar known faces
+        
+        Small populations are scanned exactly in one vectorized pass. Large
+        ones go through the IVF index and the candidates are re-ranked with
+        exact distances.
+        
+        Args:
+            encoding: Face encoding to look up
+            threshold: Minimum similarity (1 - distance) for a match
+            k: Maximum number of matches to return
+            exclude_key: Key to leave out (the worker being checked)
+            nprobe: Index cells to scan (defaults to Config.FACE_INDEX_NPROBE)
+        
+        Returns:
+            List of tuples (national_id, worker_id, status, similarity), best match first
+        """
+        query = np.asarray(encoding, dtype=np.float32).reshape(self.dim)
+        with self.lock:
+            return self._search(query, threshold, k, exclude_key, nprobe)
+    
+    def _search(
+        self,
+        query: np.ndarray,
+        threshold: float,
+        k: int,
+        exclude_key: Optional[str],
+        nprobe: Optional[int]
+    ) -> List[Tuple[str, str, str, float]]:
+        """Body of search() (caller holds the lock)"""
+        if self._count == 0:
+            return []
+        
+        if self.index.is_trained and self._use_index():
+            rows = self.index.candidates(query, nprobe or Config.FACE_INDEX_NPROBE)
+            if len(rows) == 0:
+                return []
+            distances = _row_distances(self._records, rows, query)
+        else:
+            rows = np.arange(self._count)
+            distances = _row_distances(self._records, slice(0, self._count), query)
+        face_dedup_scan_size.observe(len(rows))
+        
+        if exclude_key is not None and exclude_key in self._rows:
+            distances[rows == self._rows[exclude_key]] = np.inf
+
+        return _top_matches(self._records, rows, distances, k, threshold)
+    
+    def search_many(
+        self,
+        encodings: np.ndarray,
+        threshold: float,
+        k: int = 10,
+        exclude_keys: Optional[List[Optional[str]]] = None
+    ) -> List[List[Tuple[str, str, str, float]]]:
+        """
+        Find the most similar known faces for a batch of encodings
+        
+        Without the index the whole batch is compared against the matrix in
+        chunks of SEARCH_CHUNK rows, one matrix product per chunk.
+        
+        Args:
+            encodings: B x 128 face encodings
+            threshold: Minimum similarity (1 - distance) for a match
+            k: Maximum number of matches per encoding
+            exclude_keys: Key to leave out for each encoding
+        
+        Returns:
+            For each encoding, list of tuples (national_id, worker_id, status, similarity)
+        """
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        exclude_keys = exclude_keys or [None] * len(queries)
+        max_distance = 1.0 - threshold
+        found: List[List[Tuple[int, float]]] = [[] for _ in queries]
+        q_norms = np.einsum('ij,ij->i', queries, queries)
+        
+        with self.lock:
+            if self.index.is_trained and self._use_index():
+                return [
+                    self._search(query, threshold, k, key, None)
+                    for query, key in zip(queries, exclude_keys)
+                ]
+            
+            if max_distance < 0:
+                return [[] for _ in queries]
+            
+            for _ in queries:
+                face_dedup_scan_size.observe(self._count)
+            excluded_rows = [self._rows.get(key, -1) if key is not None else -1 for key in exclude_keys]
+            for start in range(0, self._count, self.SEARCH_CHUNK):
+                stop = min(self._count, start + self.SEARCH_CHUNK)
+                chunk = self._records[start:stop]
+                sq = (
+                    chunk['sq_norm'][None, :]
+                    - 2.0 * (queries @ chunk['vector'].T)
+                    + q_norms[:, None]
+                )
+                sq[:, chunk['alive'] == 0] = np.inf
+                for q, r in zip(*np.nonzero(sq <= max_distance * max_distance)):
+                    row = start + int(r)
+                    if row != excluded_rows[q]:
+                        found[q].append((row, float(np.sqrt(max(sq[q, r], 0.0)))))
+            
+            results = []
+            for matches in found:
+                rows = np.array([row for row, _ in matches], dtype=np.int64)
+                distances = np.array([distance for _, distance in matches], dtype=np.float32)
+                results.append(_top_matches(self._records, rows, distances, k, threshold))
+            return results
+
+
+class FaceEncodingReader:
+    """
+    Read-only view of the face encoding file for other processes
+    
+    Maps the file zero-copy with np.memmap in mode 'r', follows appends and
+    tombstones made by the sync process and remaps when the file's
+    generation, inode or size changes (a rebuild or growth).
+    """
+    
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or Config.FACE_ENCODINGS_PATH
+        self.lock = threading.Lock()
+        self._header: Optional[np.memmap] = None
+        self._records: Optional[np.memmap] = None
+        self._file_id: Optional[Tuple[int, int, int]] = None
+    
+    def _refresh(self) -> int:
+        """Remap the file if it was replaced or grew; return the valid row count (caller holds the lock)"""
+        try:
+            stat = os.stat(self.path)
+            header = np.fromfile(self.path, dtype=HEADER_DTYPE, count=1)
+        except OSError:
+            header = None
+        if header is None or len(header) == 0:
+            self._header = self._records = None
+            self._file_id = None
+            return 0
+        
+        file_id = (int(header['generation'][0]), stat.st_ino, stat.st_size)
+        if file_id != self._file_id:
+            self._header, self._records = _map_file(self.path, 'r')
+            self._file_id = file_id
+        
+        return min(int(self._header['count'][0]), len(self._records))
+    
+    def __len__(self) -> int:
+        with self.lock:
+            count = self._refresh()
+            return int(np.count_nonzero(self._records['alive'][:count])) if count else 0
+    
+    def search(self, encoding: np.ndarray, threshold: float, k: int = 10) -> List[Tuple[str, str, str, float]]:
+        """
+        Find the most similar known faces (exact scan)
+        
+        Args:
+            encoding: Face encoding to look up
+            threshold: Minimum similarity (1 - distance) for a match
+            k: Maximum number of matches to return
+        
+        Returns:
+            List of tuples (national_id, worker_id, status, similarity), best match first
+        """
+        query = np.asarray(encoding, dtype=np.float32).reshape(DIM)
+        with self.lock:
+            count = self._refresh()
+            if count == 0:
+                return []
+            distances = _row_distances(self._records, slice(0, count), query)
+            return _top_matches(self._records, np.arange(count), distances, k, threshold)
+
+
+# Global face encoding store shared by all event processors in this process
+face_store = FaceEncodingStore()
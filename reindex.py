@@ -0,0 +1,147 @@
+"""
+Backfill face encodings for existing workers
+
+Encodes every worker face image that has no valid stored encoding, in
+parallel, and then rebuilds the shared face encoding file and index so the
+sync service starts with fast duplicate detection.
+
+Usage:
+    python reindex.py [--force] [--chunk-size N] [--processes N]
+
+Progress is committed to the workers database after every chunk, so an
+interrupted run resumes where it stopped. Run it while the sync service is
+stopped, since it rewrites the workers database.
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from config import Config
+from database import open_workers_database
+from processors.event_processor import EventProcessor
+from processors.face_store import face_store
+from processors.image_processor import ImageProcessor
+from utils.logger import logger
+
+
+def load_checkpoint() -> dict:
+    """Load the checkpoint of a forced run, if any"""
+    try:
+        return json.loads(Config.REINDEX_CHECKPOINT.read_text())
+    except Exception:
+        return {}
+
+
+def save_checkpoint(checkpoint: dict):
+    """Save the checkpoint atomically"""
+    tmp_path = Config.REINDEX_CHECKPOINT.with_name(Config.REINDEX_CHECKPOINT.name + '.tmp')
+    tmp_path.write_text(json.dumps(checkpoint))
+    tmp_path.replace(Config.REINDEX_CHECKPOINT)
+
+
+def reindex(force: bool = False, chunk_size: int = 256):
+    """
+    Encode all worker faces that need it and rebuild the face store
+    
+    Args:
+        force: Re-encode every face even if a valid encoding is stored
+        chunk_size: Faces encoded (and committed) per chunk
+    """
+    workers_db = open_workers_database()
+    image_processor = ImageProcessor()
+    
+    checkpoint = load_checkpoint() if force else {}
+    if force and not checkpoint.get('force'):
+        checkpoint = {'force': True, 'started_at': datetime.utcnow().isoformat(), 'done': []}
+    done = set(checkpoint.get('done', []))
+    if done:
+        logger.info(f"Resuming forced reindex from checkpoint: {len(done)} faces already done")
+    
+    # Select workers that need encoding (deleted ones are left out of the
+    # face store, as in EventProcessor.load_face_store)
+    pending = []
+    missing_images = 0
+    for worker in workers_db.get_all_workers():
+        if worker.get('status') == 'deleted':
+            continue
+        
+        face_path = worker.get('face_image_path')
+        national_id = worker.get('nationalIdNumber')
+        if not face_path or not national_id:
+            continue
+        
+        signature = image_processor.file_signature(face_path)
+        if signature is None:
+            missing_images += 1
+            continue
+        
+        if force:
+            if national_id not in done:
+                pending.append((national_id, face_path))
+        elif worker.get('face_encoding_signature') != signature:
+            pending.append((national_id, face_path))
+    
+    total = len(pending)
+    logger.info(f"Faces to encode: {total} (missing images: {missing_images})")
+    
+    # Encode in parallel, committing every chunk
+    started = time.time()
+    encoded = 0
+    no_face = 0
+    for start in range(0, total, chunk_size):
+        chunk = pending[start:start + chunk_size]
+        encodings = image_processor.encode_faces([face_path for _, face_path in chunk])
+        
+        fields = {}
+        for (national_id, face_path), encoding in zip(chunk, encodings):
+            fields[national_id] = image_processor.encoding_fields(face_path, encoding)
+            if encoding is None:
+                no_face += 1
+        workers_db.set_face_encodings(fields)
+        
+        if force:
+            done.update(fields)
+            checkpoint['done'] = sorted(done)
+            save_checkpoint(checkpoint)
+        
+        encoded += len(chunk)
+        elapsed = time.time() - started
+        rate = encoded / elapsed if elapsed > 0 else 0.0
+        eta = (total - encoded) / rate if rate > 0 else 0.0
+        logger.info(
+            f"Encoded {encoded}/{total} faces ({encoded / total:.1%}) - "
+            f"{rate:.1f} faces/s - ETA {eta / 60:.1f} min"
+        )
+    
+    # Rebuild the shared encoding file and index from the stored encodings
+    logger.info("Rebuilding face encoding store and index...")
+    EventProcessor().load_face_store(reload=True)
+    face_store.save_index()
+    
+    if force:
+        Config.REINDEX_CHECKPOINT.unlink(missing_ok=True)
+    
+    elapsed = time.time() - started
+    logger.info(
+        f"Reindex completed: {encoded} faces encoded ({no_face} without a detectable face), "
+        f"{len(face_store)} faces in store, {elapsed:.0f}s"
+    )
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Backfill face encodings for existing workers')
+    parser.add_argument('--force', action='store_true', help='re-encode every face, not just missing or changed ones')
+    parser.add_argument('--chunk-size', type=int, default=256, help='faces encoded and committed per chunk')
+    parser.add_argument('--processes', type=int, default=None, help='encoding processes (default: Config.FACE_ENCODING_PROCESSES)')
+    args = parser.parse_args()
+    
+    if args.processes is not None:
+        Config.FACE_ENCODING_PROCESSES = args.processes
+    
+    Config.ensure_directories()
+    reindex(force=args.force, chunk_size=max(1, args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Cross-process file lock
+
+Lets the sync service and separately running dashboard processes share
+the JSON data files: writers hold an exclusive flock on a sidecar
+".lock" file while they read, modify and atomically replace a file.
+"""
+import os
+import threading
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: the lock only covers threads of this process
+    fcntl = None
+
+
+class FileLock:
+    """
+    Exclusive lock shared by threads and processes
+    
+    Re-entrant within a thread, like threading.RLock. Threads of one process
+    are serialized by an RLock (flock doesn't distinguish them); processes
+    by flock on the lock file, which the OS releases if a process dies.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        self._pid = None
+    
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                # A forked child (e.g. a pre-forking WSGI worker) needs its own
+                # open file: flock is shared through an inherited descriptor
+                if self._fd is None or self._pid != os.getpid():
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    self._pid = os.getpid()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+    
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def lock_path(path: Path) -> Path:
+    """Sidecar lock file of a data file"""
+    return path.with_name(path.name + '.lock')
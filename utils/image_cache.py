@@ -0,0 +1,231 @@
+"""
+Content-addressed cache of downloaded images
+
+Image bytes are stored once under Config.IMAGE_CACHE_DIR, keyed by their
+SHA-256. A URL index remembers which hash each URL last returned together
+with its ETag / Last-Modified validators, so a repeat download can be a
+conditional GET answered from the cache on 304 Not Modified.
+
+A blob's mtime is its last use; prune() evicts by age and least recent use
+and drops the URL entries of evicted blobs.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+from config import Config
+from utils.logger import logger
+
+
+class ImageCache:
+    """SHA-256 keyed image store with a URL -> hash index"""
+    
+    def __init__(self, cache_dir: Optional[Path] = None, index_path: Optional[Path] = None):
+        self._cache_dir = cache_dir
+        self._index_path = index_path
+        self.lock = threading.Lock()
+        self._urls: Optional[Dict[str, Dict]] = None
+        self._dirty = False
+    
+    @property
+    def cache_dir(self) -> Path:
+        return self._cache_dir or Config.IMAGE_CACHE_DIR
+    
+    @property
+    def index_path(self) -> Path:
+        return self._index_path or Config.IMAGE_CACHE_INDEX
+    
+    @staticmethod
+    def content_hash(data: bytes) -> str:
+        """SHA-256 hex digest of image bytes"""
+        return hashlib.sha256(data).hexdigest()
+    
+    def _blob_path(self, sha256: str) -> Path:
+        return self.cache_dir / sha256[:2] / sha256
+    
+    def _load_index(self) -> Dict[str, Dict]:
+        """URL index, read from disk on first use (call with lock held)"""
+        if self._urls is None:
+            try:
+                self._urls = json.loads(self.index_path.read_text())
+            except FileNotFoundError:
+                self._urls = {}
+            except Exception as e:
+                logger.error(f"Error reading image cache index: {e}")
+                self._urls = {}
+        return self._urls
+    
+    def get(self, sha256: str) -> Optional[bytes]:
+        """
+        Get cached image bytes by hash
+        
+        Args:
+            sha256: Content hash
+        
+        Returns:
+            Image bytes, or None if not cached
+        """
+        path = self._blob_path(sha256)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # mark as recently used for prune()
+        except OSError:
+            pass
+        return data
+    
+    def put(self, data: bytes) -> str:
+        """
+        Store image bytes (no-op if already cached)
+        
+        Args:
+            data: Image bytes
+        
+        Returns:
+            Content hash
+        """
+        sha256 = self.content_hash(data)
+        path = self._blob_path(sha256)
+        if path.exists():
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + f'.{threading.get_ident()}.tmp')
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        return sha256
+    
+    def url_hash(self, url: str) -> Optional[str]:
+        """Content hash the URL returned last time, if known"""
+        with self.lock:
+            entry = self._load_index().get(url)
+        return entry['sha256'] if entry else None
+    
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """
+        Request headers to revalidate a cached URL
+        
+        Args:
+            url: Image URL
+        
+        Returns:
+            If-None-Match / If-Modified-Since headers, or an empty dict if
+            the URL is not cached or has no validators
+        """
+        with self.lock:
+            entry = self._load_index().get(url)
+        if not entry or not self._blob_path(entry['sha256']).exists():
+            return {}
+        
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def get_url(self, url: str) -> Optional[bytes]:
+        """Cached bytes of a URL (e.g. after 304 Not Modified)"""
+        sha256 = self.url_hash(url)
+        return self.get(sha256) if sha256 else None
+    
+    def put_url(
+        self,
+        url: str,
+        data: bytes,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None
+    ) -> str:
+        """
+        Store a downloaded image and remember it for its URL
+        
+        Args:
+            url: Image URL
+            data: Image bytes
+            etag: ETag response header
+            last_modified: Last-Modified response header
+        
+        Returns:
+            Content hash
+        """
+        sha256 = self.put(data)
+        with self.lock:
+            self._load_index()[url] = {
+                'sha256': sha256,
+                'etag': etag or '',
+                'last_modified': last_modified or ''
+            }
+            self._dirty = True
+        return sha256
+    
+    def prune(self, max_age_days: Optional[int] = None, max_mb: Optional[int] = None) -> int:
+        """
+        Evict cached images by age, then least recently used ones by total size
+        
+        Args:
+            max_age_days: Drop images unused for longer (default Config.IMAGE_CACHE_MAX_AGE_DAYS, 0 = keep)
+            max_mb: Size limit of the cache (default Config.IMAGE_CACHE_MAX_MB, 0 = no limit)
+        
+        Returns:
+            Number of images removed
+        """
+        max_age_days = Config.IMAGE_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+        max_mb = Config.IMAGE_CACHE_MAX_MB if max_mb is None else max_mb
+        
+        blobs = []
+        for path in self.cache_dir.glob('??/*'):
+            if path.name.endswith('.tmp'):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, path))
+        blobs.sort()  # least recently used first
+        
+        cutoff = time.time() - max_age_days * 86400 if max_age_days else None
+        total = sum(size for _, size, _ in blobs)
+        max_bytes = max_mb * 1024 * 1024 if max_mb else None
+        
+        removed = set()
+        for mtime, size, path in blobs:
+            if not (cutoff is not None and mtime < cutoff) and not (max_bytes is not None and total > max_bytes):
+                break
+            path.unlink(missing_ok=True)
+            removed.add(path.name)
+            total -= size
+        
+        if removed:
+            with self.lock:
+                urls = self._load_index()
+                for url in [url for url, entry in urls.items() if entry['sha256'] in removed]:
+                    del urls[url]
+                self._dirty = True
+            self.save()
+            logger.info(f"Image cache: evicted {len(removed)} images, {total / 1024 / 1024:.1f} MB left")
+        return len(removed)
+    
+    def save(self):
+        """Persist the URL index if it changed"""
+        with self.lock:
+            if not self._dirty:
+                return
+            try:
+                tmp_path = self.index_path.with_name(self.index_path.name + '.tmp')
+                tmp_path.write_text(json.dumps(self._urls))
+                tmp_path.replace(self.index_path)
+                self._dirty = False
+            except Exception as e:
+                logger.error(f"Error writing image cache index: {e}")
+
+
+# Shared cache used by the API clients and the event processor
+image_cache = ImageCache()
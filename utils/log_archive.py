@@ -0,0 +1,188 @@
+"""
+Compressed daily archives of expired request logs
+
+Segments leaving the hot store are appended to one compressed JSON-lines
+file per UTC day (gzip or lzma, appended as extra members/streams), next to
+a small sidecar index with the day's time range, counts and error counts.
+Reads use the sidecars to skip whole days and stream the rest line by line.
+"""
+import gzip
+import json
+import lzma
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+
+COMPRESSORS = {
+    'gzip': (gzip, '.jsonl.gz'),
+    'lzma': (lzma, '.jsonl.xz'),
+}
+
+
+class RequestLogArchive:
+    """Daily compressed log archives with sidecar indexes"""
+    
+    PREFIX = 'requests-'
+    DAY_FORMAT = '%Y%m%d'
+    INDEX_SUFFIX = '.index.json'
+    
+    def __init__(self, archive_dir: Path, compression: str = 'gzip'):
+        if compression not in COMPRESSORS:
+            raise ValueError(f"Unknown archive compression: {compression}")
+        self.archive_dir = archive_dir
+        self.compression = compression
+    
+    def _index_path(self, day: str) -> Path:
+        return self.archive_dir / f"{self.PREFIX}{day}{self.INDEX_SUFFIX}"
+    
+    def _read_index(self, path: Path) -> Optional[Dict]:
+        try:
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading log archive index {path.name}: {e}")
+            return None
+    
+    def _write_index(self, day: str, index: Dict):
+        path = self._index_path(day)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(index, indent=2))
+        os.replace(tmp_path, path)
+    
+    def add_segment(self, day: datetime, name: str, data: bytes) -> int:
+        """
+        Append a segment's JSON lines to the archive of its day
+        
+        Idempotent per segment name, so a segment whose deletion was
+        interrupted is not archived twice. The sidecar records the archive
+        size after each append and is replaced atomically once the append
+        is complete; bytes past that size (an append interrupted before its
+        index write) are truncated before the next append. Call with the
+        logs lock held.
+        
+        Args:
+            day: Day the segment belongs to (UTC)
+            name: Segment file name
+            data: Segment contents
+        
+        Returns:
+            Number of logs archived
+        """
+        day_key = day.strftime(self.DAY_FORMAT)
+        index = self._read_index(self._index_path(day_key))
+        if index is None:
+            index = {
+                'date': day.strftime('%Y-%m-%d'),
+                'file': None,
+                'first_timestamp': None,
+                'last_timestamp': None,
+                'size': 0,
+                'count': 0,
+                'errors': 0,
+                'api_targets': {},
+                'segments': []
+            }
+        if name in index['segments']:
+            return 0
+        
+        lines = []
+        for line in data.splitlines():
+            try:
+                log = json.loads(line)
+            except ValueError:
+                continue  # partially written line
+            lines.append(line)
+            
+            timestamp = log.get('timestamp') or ''
+            if timestamp and (index['first_timestamp'] is None or timestamp < index['first_timestamp']):
+                index['first_timestamp'] = timestamp
+            if timestamp and (index['last_timestamp'] is None or timestamp > index['last_timestamp']):
+                index['last_timestamp'] = timestamp
+            index['count'] += 1
+            status_code = log.get('status_code') or 0
+            index['errors'] += not 200 <= status_code < 300
+            target = log.get('api_target') or ''
+            index['api_targets'][target] = index['api_targets'].get(target, 0) + 1
+        
+        # Keep appending to the file the day started with, even if the setting changed
+        file_name = index['file'] or f"{self.PREFIX}{day_key}{COMPRESSORS[self.compression][1]}"
+        path = self.archive_dir / file_name
+        if lines:
+            self.archive_dir.mkdir(parents=True, exist_ok=True)
+            # Drop what an append left behind when it was cut off before its index write
+            size = index.get('size')
+            if size is not None and path.exists() and path.stat().st_size > size:
+                os.truncate(path, size)
+            with self._open(path, 'ab') as f:
+                f.write(b'\n'.join(lines) + b'\n')
+            index['size'] = path.stat().st_size
+        
+        index['file'] = file_name
+        index['segments'].append(name)
+        self._write_index(day_key, index)
+        return len(lines)
+    
+    @staticmethod
+    def _open(path: Path, mode: str):
+        """Open an archive with the compressor its extension names"""
+        for module, suffix in COMPRESSORS.values():
+            if path.name.endswith(suffix):
+                return module.open(path, mode)
+        raise ValueError(f"Unknown archive type: {path.name}")
+    
+    def list_archives(self) -> List[Dict]:
+        """Sidecar indexes of all archived days, oldest first"""
+        archives = []
+        for path in sorted(self.archive_dir.glob(f"{self.PREFIX}*{self.INDEX_SUFFIX}")):
+            index = self._read_index(path)
+            if index and index.get('file'):
+                archives.append(index)
+        return archives
+    
+    def iter_logs(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Stream archived logs, oldest first
+        
+        Args:
+            start_date: ISO timestamp; earlier logs are skipped
+            end_date: ISO timestamp; later logs are skipped
+        """
+        for index in self.list_archives():
+            if start_date and index['last_timestamp'] and index['last_timestamp'] < start_date:
+                continue
+            if end_date and index['first_timestamp'] and index['first_timestamp'] > end_date:
+                continue
+            
+            try:
+                with self._open(self.archive_dir / index['file'], 'rb') as f:
+                    for line in f:
+                        try:
+                            log = json.loads(line)
+                        except ValueError:
+                            continue
+                        timestamp = log.get('timestamp') or ''
+                        if start_date and timestamp < start_date:
+                            continue
+                        if end_date and timestamp > end_date:
+                            continue
+                        yield log
+            except (OSError, EOFError, lzma.LZMAError) as e:
+                print(f"Error reading log archive {index['file']}: {e}")
+    
+    def prune(self, cutoff: datetime) -> int:
+        """Delete archived days before cutoff; returns the number deleted"""
+        cutoff_key = cutoff.strftime(self.DAY_FORMAT)
+        removed = 0
+        for path in self.archive_dir.glob(f"{self.PREFIX}*{self.INDEX_SUFFIX}"):
+            day_key = path.name[len(self.PREFIX):-len(self.INDEX_SUFFIX)]
+            if day_key >= cutoff_key:
+                continue
+            index = self._read_index(path)
+            if index and index.get('file'):
+                (self.archive_dir / index['file']).unlink(missing_ok=True)
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
@@ -0,0 +1,179 @@
+"""
+Columnar in-memory index of request log metadata
+
+Each log segment is indexed once into NumPy columns (epoch timestamp,
+status code, duration, categorical codes for API target, method and
+endpoint, and the byte offset/length of the JSON line). Filters are
+vectorized masks over those columns; full log bodies are only parsed for
+the rows actually returned.
+"""
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+
+
+EPOCH = datetime(1970, 1, 1)
+
+COLUMN_DTYPES = {
+    'timestamp': np.float64,
+    'status_code': np.int32,
+    'duration_ms': np.int64,
+    'api_target': np.int32,
+    'method': np.int32,
+    'endpoint': np.int32,
+    'offset': np.int64,
+    'length': np.int32,
+}
+
+CATEGORICAL = ('api_target', 'method', 'endpoint')
+
+
+def to_epoch(value: str) -> float:
+    """Seconds since the epoch of a naive UTC ISO timestamp (NaN if invalid)"""
+    try:
+        return (datetime.fromisoformat(value) - EPOCH).total_seconds()
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+class _SegmentColumns:
+    """Indexed columns of one segment file"""
+    
+    def __init__(self):
+        self.indexed_bytes = 0
+        self.columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+        self.time_sorted = True
+    
+    def __len__(self) -> int:
+        return len(self.columns['offset'])
+
+
+class RequestLogIndex:
+    """
+    Columnar index over JSON-lines log segments
+    
+    Segments are indexed lazily and incrementally: on each query only the
+    bytes appended since the last query are parsed, so the index stays
+    current whoever appends to the files.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._segments: Dict[Path, _SegmentColumns] = {}
+        self._codes: Dict[str, Dict[str, int]] = {name: {} for name in CATEGORICAL}
+        self._endpoints_lower: List[str] = []
+        self._endpoint_matches: Dict[str, tuple] = {}
+    
+    def _code(self, field: str, value) -> int:
+        """Categorical code of a value (assigned on first sight)"""
+        value = value if isinstance(value, str) else ''
+        codes = self._codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+            if field == 'endpoint':
+                self._endpoints_lower.append(value.lower())
+        return code
+    
+    def code_of(self, field: str, value: str) -> Optional[int]:
+        """Existing code of a value, or None if it never occurred"""
+        return self._codes[field].get(value)
+    
+    def endpoint_codes_containing(self, needle: str) -> np.ndarray:
+        """Codes of all endpoints containing needle (case-insensitive)"""
+        needle = needle.lower()
+        with self.lock:
+            known, codes = self._endpoint_matches.get(needle, (0, []))
+            # Only endpoints first seen since the last lookup need checking
+            codes = codes + [
+                code for code in range(known, len(self._endpoints_lower))
+                if needle in self._endpoints_lower[code]
+            ]
+            self._endpoint_matches[needle] = (len(self._endpoints_lower), codes)
+            return np.array(codes, dtype=np.int32)
+    
+    def columns(self, path: Path) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Columns of a segment, indexing any bytes appended since last time
+        
+        Args:
+            path: Segment file
+        
+        Returns:
+            Dict of column arrays (plus 'time_sorted'), or None if the file is gone
+        """
+        with self.lock:
+            segment = self._segments.get(path)
+            if segment is None:
+                segment = self._segments[path] = _SegmentColumns()
+            
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(segment.indexed_bytes)
+                    data = f.read()
+            except FileNotFoundError:
+                del self._segments[path]
+                return None
+            
+            if data:
+                self._index_bytes(segment, data)
+            
+            return {**segment.columns, 'time_sorted': segment.time_sorted}
+    
+    def _index_bytes(self, segment: _SegmentColumns, data: bytes):
+        """Parse newly appended complete lines into the segment columns"""
+        rows = {name: [] for name in COLUMN_DTYPES}
+        position = 0
+        end = data.rfind(b'\n') + 1  # a trailing partial line waits for the next call
+        
+        while position < end:
+            newline = data.index(b'\n', position)
+            line = data[position:newline]
+            offset = segment.indexed_bytes + position
+            position = newline + 1
+            try:
+                log = json.loads(line)
+            except ValueError:
+                continue
+            
+            rows['timestamp'].append(to_epoch(log.get('timestamp')))
+            rows['status_code'].append(log.get('status_code') or 0)
+            rows['duration_ms'].append(log.get('duration_ms') or 0)
+            rows['api_target'].append(self._code('api_target', log.get('api_target')))
+            rows['method'].append(self._code('method', log.get('method')))
+            rows['endpoint'].append(self._code('endpoint', log.get('endpoint')))
+            rows['offset'].append(offset)
+            rows['length'].append(len(line))
+        
+        segment.indexed_bytes += end
+        if not rows['offset']:
+            return
+        
+        for name, dtype in COLUMN_DTYPES.items():
+            segment.columns[name] = np.concatenate([segment.columns[name], np.array(rows[name], dtype=dtype)])
+        
+        timestamps = segment.columns['timestamp']
+        segment.time_sorted = bool(np.all(timestamps[1:] >= timestamps[:-1]))
+    
+    def forget(self, existing: Iterable[Path]):
+        """Drop segments that no longer exist"""
+        existing = set(existing)
+        with self.lock:
+            for path in [path for path in self._segments if path not in existing]:
+                del self._segments[path]
+    
+    @staticmethod
+    def read_rows(path: Path, offsets: np.ndarray, lengths: np.ndarray) -> List[Dict]:
+        """Parse the full logs at the given byte offsets of a segment"""
+        logs = []
+        try:
+            with open(path, 'rb') as f:
+                for offset, length in zip(offsets.tolist(), lengths.tolist()):
+                    f.seek(offset)
+                    logs.append(json.loads(f.read(length)))
+        except FileNotFoundError:
+            pass  # deleted by retention (possibly in another process) meanwhile
+        return logs
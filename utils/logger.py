@@ -1,10 +1,16 @@
 """
 Enhanced logging system with API request tracking
 """
+import atexit
+import itertools
 import logging
+import queue
+import threading
+import time
 import uuid
 from datetime import datetime
 from typing import Any, Dict, Optional
+from config import Config
 from database import RequestLogsDatabase
 from utils.sanitizer import DataSanitizer
 
@@ -21,12 +27,34 @@ logging.basicConfig(
 logger = logging.getLogger('hydepark-sync')
 
 
+# Queue marker telling the writer thread to stop
+_STOP = object()
+
+
 class RequestLogger:
-    """Logger for API requests with sanitization"""
+    """
+    Logger for API requests with sanitization
+    
+    log_request only queues the raw request data; a background writer thread
+    sanitizes and stores the logs in batches (every REQUEST_LOG_BATCH_SIZE
+    logs or REQUEST_LOG_FLUSH_SECONDS), so API calls don't wait for log I/O.
+    Set Config.REQUEST_LOG_ASYNC to False to write synchronously.
+    
+    How much of a request is kept follows Config.REQUEST_LOG_CAPTURE: with
+    'tiered', routine successes are reduced to metadata (and sampled) before
+    they are queued, so their bodies are never sanitized or written.
+    """
     
     def __init__(self):
         self.db = RequestLogsDatabase()
         self.sanitizer = DataSanitizer()
+        self.queue: queue.Queue = queue.Queue(maxsize=Config.REQUEST_LOG_QUEUE_SIZE)
+        self.dropped = 0
+        self._dropped_reported = 0
+        self._overflow_count = 0
+        self._success_counter = itertools.count(1)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
     
     def log_request(
         self,
@@ -56,53 +84,282 @@ class RequestLogger:
             response_body: Response body
             error: Error message if request failed
         """
+        failed = bool(error) or not 200 <= status_code < 300
+        capture = self._capture_level(failed, (end_time - start_time) * 1000, response_body)
+        if capture != 'full':
+            headers, body, response_body = None, None, None
+        
+        entry = (
+            api_target, endpoint, method, dict(headers or {}), body,
+            start_time, end_time, status_code, response_body, error,
+            datetime.utcnow(), capture
+        )
+        
+        if not Config.REQUEST_LOG_ASYNC:
+            self._write_batch([entry])
+            return
+        
+        self._start_writer()
+        self._enqueue(entry, failed=failed)
+    
+    def _capture_level(self, failed: bool, duration_ms: float, response_body: Any) -> str:
+        """
+        How much of a request to keep (Config.REQUEST_LOG_CAPTURE)
+        
+        Returns:
+            'full' (headers and bodies), 'metadata' (stored without them) or
+            'count' (only counted in the stats)
+        """
+        if (
+            Config.REQUEST_LOG_CAPTURE == 'full'
+            or failed
+            or duration_ms >= Config.REQUEST_LOG_SLOW_MS
+            # Polls that returned events are what the dashboard highlights
+            or (isinstance(response_body, dict) and response_body.get('events'))
+        ):
+            return 'full'
+        
+        rate = max(Config.REQUEST_LOG_SUCCESS_SAMPLE_RATE, 1)
+        return 'metadata' if next(self._success_counter) % rate == 0 else 'count'
+    
+    def _enqueue(self, entry: tuple, failed: bool):
+        """Queue a log entry, applying the overflow policy when the queue is full"""
         try:
-            # Calculate duration
-            duration_ms = int((end_time - start_time) * 1000)
-            
-            # Sanitize data
-            sanitized_headers = self.sanitizer.sanitize_headers(headers)
-            sanitized_body = self.sanitizer.sanitize_body(body)
-            sanitized_body = self.sanitizer.redact_base64_images(sanitized_body)
-            sanitized_response = self.sanitizer.sanitize_body(response_body)
-            sanitized_response = self.sanitizer.redact_base64_images(sanitized_response)
+            self.queue.put_nowait(entry)
+            return
+        except queue.Full:
+            pass
+        
+        policy = Config.REQUEST_LOG_OVERFLOW_POLICY
+        if policy == 'sample' and not failed:
+            rate = Config.REQUEST_LOG_OVERFLOW_SAMPLE_RATE
+            self._overflow_count += 1
+            wait = rate > 0 and self._overflow_count % rate == 0
+        else:
+            wait = policy in ('sample', 'block')
+        
+        if wait:
+            try:
+                self.queue.put(entry, timeout=Config.REQUEST_LOG_BLOCK_SECONDS)
+                return
+            except queue.Full:
+                pass
+        
+        self.dropped += 1
+    
+    def _start_writer(self):
+        """Start the background writer thread on first use"""
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run_writer, name='request-log-writer', daemon=True)
+                self._writer.start()
+    
+    def _run_writer(self):
+        """Writer thread: collect batches by size or time and store them"""
+        batch_size = Config.REQUEST_LOG_BATCH_SIZE
+        flush_seconds = Config.REQUEST_LOG_FLUSH_SECONDS
+        
+        while True:
+            entry = self.queue.get()
+            stop = entry is _STOP
+            batch = [] if stop else [entry]
+            deadline = time.monotonic() + flush_seconds
             
-            # Create log record
-            log_record = {
-                'id': str(uuid.uuid4()),
-                'timestamp': datetime.utcnow().isoformat(),
-                'api_target': api_target,
-                'endpoint': endpoint,
-                'method': method,
-                'headers': sanitized_headers,
-                'body': sanitized_body,
-                'status_code': status_code,
-                'response_body': sanitized_response,
-                'duration_ms': duration_ms,
-                'error': error,
-                'success': 200 <= status_code < 300
-            }
+            while not stop and len(batch) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stop = True
+                else:
+                    batch.append(entry)
             
-            # Store in database
-            self.db.add_log(log_record)
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self.queue.task_done()
             
-            # Also log to standard logger
-            if error:
-                logger.error(f"{api_target.upper()} {method} {endpoint} - {status_code} - {duration_ms}ms - ERROR: {error}")
-            else:
-                logger.info(f"{api_target.upper()} {method} {endpoint} - {status_code} - {duration_ms}ms")
+            if stop:
+                return
+    
+    def _write_batch(self, entries: list):
+        """Sanitize and store queued log entries"""
+        records = []
+        stored = []
+        counted = []
+        for entry in entries:
+            try:
+                record = self._build_record(*entry)
+            except Exception as e:
+                logger.error(f"Error logging request: {e}")
+                continue
+            records.append(record)
+            (counted if record['capture'] == 'count' else stored).append(record)
         
+        try:
+            self.db.add_logs(stored, stats_only=counted)
         except Exception as e:
-            logger.error(f"Error logging request: {e}")
+            logger.error(f"Error storing request logs: {e}")
+        
+        # Also log to standard logger
+        for record in records:
+            if record['error']:
+                logger.error(
+                    f"{record['api_target'].upper()} {record['method']} {record['endpoint']} - "
+                    f"{record['status_code']} - {record['duration_ms']}ms - ERROR: {record['error']}"
+                )
+            else:
+                logger.info(
+                    f"{record['api_target'].upper()} {record['method']} {record['endpoint']} - "
+                    f"{record['status_code']} - {record['duration_ms']}ms"
+                )
+        
+        if self.dropped > self._dropped_reported:
+            logger.warning(f"Request log queue full: dropped {self.dropped - self._dropped_reported} logs")
+            self._dropped_reported = self.dropped
     
-    def get_recent_logs(self, limit: int = 100, filters: Dict = None) -> list:
+    def _build_record(
+        self,
+        api_target: str,
+        endpoint: str,
+        method: str,
+        headers: Dict,
+        body: Any,
+        start_time: float,
+        end_time: float,
+        status_code: int,
+        response_body: Any,
+        error: Optional[str],
+        logged_at: datetime,
+        capture: str = 'full'
+    ) -> Dict:
+        """Build the sanitized log record of a request"""
+        # Calculate duration
+        duration_ms = int((end_time - start_time) * 1000)
+        
+        # Create log record
+        record = {
+            'id': str(uuid.uuid4()),
+            'timestamp': logged_at.isoformat(),
+            'api_target': api_target,
+            'endpoint': endpoint,
+            'method': method,
+            'status_code': status_code,
+            'duration_ms': duration_ms,
+            'error': error,
+            'success': 200 <= status_code < 300,
+            'capture': capture
+        }
+        
+        if capture == 'full':
+            # Sanitize data
+            max_bytes = Config.REQUEST_LOG_MAX_FIELD_BYTES
+            record['headers'] = self._cap_field(self.sanitizer.sanitize_headers(headers))
+            record['body'] = self._cap_field(self.sanitizer.sanitize_payload(body, max_bytes))
+            record['response_body'] = self._cap_field(self.sanitizer.sanitize_payload(response_body, max_bytes))
+        
+        return record
+    
+    @staticmethod
+    def _cap_field(value: Any) -> Any:
+        """
+        Value capped to about REQUEST_LOG_MAX_FIELD_BYTES of UTF-8
+        
+        Dicts and lists keep their shape: values past the budget are left
+        out (a top-level dict notes how many under '_truncated'), and a
+        string crossing it is cut at the byte limit.
+        """
+        omitted = [0]
+        capped, _ = RequestLogger._cap_value(value, Config.REQUEST_LOG_MAX_FIELD_BYTES, omitted)
+        if omitted[0] and isinstance(capped, dict):
+            capped['_truncated'] = omitted[0]
+        return capped
+    
+    @staticmethod
+    def _cap_value(value: Any, budget: int, omitted: list) -> tuple:
+        """Capped value and its approximate serialized size in bytes"""
+        if isinstance(value, str):
+            size = len(value) if value.isascii() else len(value.encode('utf-8'))
+            if size + 2 <= budget:
+                return value, size + 2
+            # Cut at the byte limit, dropping a character split by the cut
+            text = value.encode('utf-8')[:max(budget, 0)].decode('utf-8', 'ignore')
+            return f'{text}...[TRUNCATED {size} BYTES]', budget
+        
+        if isinstance(value, dict):
+            capped, used = {}, 2
+            for key, item in value.items():
+                if used >= budget:
+                    omitted[0] += 1
+                    continue
+                used += len(str(key)) + 6
+                capped[key], size = RequestLogger._cap_value(item, budget - used, omitted)
+                used += size
+            return capped, used
+        
+        if isinstance(value, list):
+            capped, used = [], 2
+            for item in value:
+                if used >= budget:
+                    omitted[0] += 1
+                    continue
+                item, size = RequestLogger._cap_value(item, budget - used, omitted)
+                capped.append(item)
+                used += size + 2
+            return capped, used
+        
+        return value, len(str(value))
+    
+    def flush(self):
+        """Wait until all queued logs are stored"""
+        if self._writer is not None and self._writer.is_alive():
+            self.queue.join()
+    
+    def close(self, timeout: float = 10.0):
+        """Store the queued logs, stop the writer thread and persist the stats (called at exit)"""
+        if self._writer is not None and self._writer.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+                self._writer.join(timeout)
+            except queue.Full:
+                logger.warning("Request log queue still full at shutdown, some logs are lost")
+        self.db.flush_stats()
+    
+    def get_recent_logs(self, limit: int = 100, filters: Dict = None, offset: int = 0, fields: list = None) -> list:
         """Get recent request logs"""
-        return self.db.get_recent_logs(limit, filters)
+        return self.db.get_recent_logs(limit, filters, offset, fields)
     
     def get_stats(self) -> Dict:
         """Get request statistics"""
         return self.db.get_stats()
     
+    def get_endpoint_stats(self) -> list:
+        """Get request statistics per API target + endpoint"""
+        return self.db.get_endpoint_stats()
+    
+    def get_stats_timeline(self, resolution: str = 'minute', limit: int = 60) -> list:
+        """Get per-minute or per-hour request statistics"""
+        return self.db.get_stats_timeline(resolution, limit)
+    
+    def get_endpoint_histograms(self) -> Dict:
+        """Get the raw latency histograms per API target + endpoint"""
+        return self.db.get_endpoint_histograms()
+    
+    def get_archives(self) -> list:
+        """Get the index of archived log days"""
+        return self.db.get_archives()
+    
+    def iter_archived_logs(self, start_date: str = None, end_date: str = None):
+        """Stream archived request logs, oldest first"""
+        return self.db.iter_archived_logs(start_date, end_date)
+    
     def cleanup_old_logs(self):
         """Clean up old logs based on retention policy"""
         self.db.cleanup_old_logs()
@@ -110,3 +367,4 @@ class RequestLogger:
 
 # Global request logger instance
 request_logger = RequestLogger()
+atexit.register(request_logger.close)
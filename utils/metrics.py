@@ -0,0 +1,247 @@
+"""
+In-process metrics in the Prometheus text exposition format
+
+Counters, gauges and histograms are plain dicts keyed by label values,
+each metric guarded by its own lock for the few instructions an update
+takes. The dashboard serves them at /metrics; when it runs in separate
+processes, the sync service writes a snapshot after every cycle instead.
+"""
+import math
+import os
+import threading
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    TYPE = ''
+    
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+    
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+    
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.TYPE}']
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    
+    TYPE = 'counter'
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def render(self) -> List[str]:
+        with self.lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+            for key, value in sorted(values)
+        ]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+    
+    TYPE = 'gauge'
+    
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Distribution over fixed upper bounds (bucket counts, sum and count)"""
+    
+    TYPE = 'histogram'
+    
+    def __init__(self, name: str, help_text: str, buckets: List[float], labels: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labels)
+        self.buckets = sorted(buckets)
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bucket] += 1
+            state[1] += value
+    
+    def render(self) -> List[str]:
+        with self.lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        lines = self.header()
+        for key, counts, total in sorted(values):
+            lines += histogram_lines(self.name, self.label_names, key, self.buckets, counts, total)
+        return lines
+
+
+def histogram_lines(
+    name: str,
+    label_names: Tuple[str, ...],
+    label_values: Tuple,
+    buckets: List[float],
+    counts: List[int],
+    total: float
+) -> List[str]:
+    """
+    Exposition lines of one histogram series
+    
+    Args:
+        counts: Per-bucket (not cumulative) counts, with one more for +Inf
+        total: Sum of the observed values
+    """
+    lines = []
+    cumulative = 0
+    for bound, count in zip(list(buckets) + [math.inf], counts):
+        cumulative += count
+        labels = _format_labels(label_names + ('le',), tuple(label_values) + (_format_value(bound),))
+        lines.append(f'{name}_bucket{labels} {cumulative}')
+    labels = _format_labels(label_names, label_values)
+    lines.append(f'{name}_sum{labels} {_format_value(total)}')
+    lines.append(f'{name}_count{labels} {cumulative}')
+    return lines
+
+
+def request_stats_lines(buckets_ms: List[float], endpoints: Dict[str, Dict]) -> List[str]:
+    """
+    Exposition lines of the request log stats (see database.RequestStats)
+    
+    Args:
+        buckets_ms: Latency histogram bounds in milliseconds
+        endpoints: Stat per "api_target endpoint" key
+    """
+    labels = ('api_target', 'endpoint')
+    series = sorted(
+        (tuple(key.split(' ', 1)) if ' ' in key else (key, ''), stat)
+        for key, stat in endpoints.items()
+    )
+    lines = [
+        '# HELP hydepark_api_requests_total Outgoing API requests, by target and endpoint',
+        '# TYPE hydepark_api_requests_total counter',
+    ]
+    lines += [f'hydepark_api_requests_total{_format_labels(labels, key)} {stat["count"]}' for key, stat in series]
+    lines += [
+        '# HELP hydepark_api_request_failures_total Outgoing API requests that failed (non-2xx)',
+        '# TYPE hydepark_api_request_failures_total counter',
+    ]
+    lines += [f'hydepark_api_request_failures_total{_format_labels(labels, key)} {stat["failures"]}' for key, stat in series]
+    lines += [
+        '# HELP hydepark_api_request_duration_seconds Outgoing API request latency',
+        '# TYPE hydepark_api_request_duration_seconds histogram',
+    ]
+    buckets = [bound / 1000 for bound in buckets_ms]
+    for key, stat in series:
+        lines += histogram_lines(
+            'hydepark_api_request_duration_seconds', labels, key,
+            buckets, stat['histogram'], stat['duration_sum'] / 1000
+        )
+    return lines
+
+
+class MetricsRegistry:
+    """The metrics of this process"""
+    
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+    
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+    
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+    
+    def histogram(self, name: str, help_text: str, buckets: List[float], labels: Tuple[str, ...] = ()) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets, labels))
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+    
+    def write_snapshot(self, path: Path):
+        """Write the rendered metrics atomically (for a dashboard in another process)"""
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(self.render())
+        os.replace(tmp_path, path)
+    
+    @staticmethod
+    def read_snapshot(path: Path) -> Optional[str]:
+        try:
+            return path.read_text()
+        except FileNotFoundError:
+            return None
+
+
+registry = MetricsRegistry()
+
+SECONDS_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+hikcentral_errors = registry.counter(
+    'hydepark_hikcentral_errors_total',
+    'HikCentral calls that failed, by HikCentral result code (http_<status> or network for transport errors)',
+    ('code',)
+)
+events_processed = registry.counter(
+    'hydepark_events_processed_total',
+    'Sync events processed, by event type and result',
+    ('type', 'result')
+)
+face_encode_seconds = registry.histogram(
+    'hydepark_face_encode_seconds',
+    'Time to decode, detect and encode one face image',
+    [0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16]
+)
+face_dedup_scan_size = registry.histogram(
+    'hydepark_face_dedup_scan_size',
+    'Known faces compared per duplicate search',
+    [0, 10, 100, 1000, 10000, 100000, 1000000]
+)
+sync_cycle_seconds = registry.histogram(
+    'hydepark_sync_cycle_seconds',
+    'Duration of a sync cycle (fetch and process pending events)',
+    SECONDS_BUCKETS
+)
+sync_backlog = registry.gauge(
+    'hydepark_sync_backlog_events',
+    'Pending events returned by the last poll'
+)
+sync_last_cycle = registry.gauge(
+    'hydepark_sync_last_cycle_timestamp_seconds',
+    'Unix time the last sync cycle finished'
+)
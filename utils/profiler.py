@@ -0,0 +1,198 @@
+"""
+On-demand profiling of sync cycles
+
+The dashboard arms the profiler for the next N cycles by writing a small
+arm file (it may run in another process than the sync service). Each
+armed cycle runs under cProfile while a background thread samples the
+cycle thread's stack; the cycle leaves a .pstats file and a collapsed-stack
+text file ("frame;frame;frame count" lines, as read by flamegraph.pl or
+speedscope) in Config.PROFILES_DIR.
+"""
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import Config
+from utils.file_lock import FileLock, lock_path
+from utils.logger import logger
+
+
+PSTATS_SUFFIX = '.pstats'
+COLLAPSED_SUFFIX = '.collapsed.txt'
+
+_arm_lock = FileLock(lock_path(Config.PROFILE_ARM_PATH))
+
+
+def _read_arm() -> Optional[Dict]:
+    try:
+        return json.loads(Config.PROFILE_ARM_PATH.read_text())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Error reading profiler arm file: {e}")
+        return None
+
+
+def _write_arm(arm: Dict):
+    path = Config.PROFILE_ARM_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(arm))
+    os.replace(tmp_path, path)
+
+
+def arm(cycles: int, requested_by: str = '') -> Dict:
+    """
+    Profile the next sync cycles
+    
+    Args:
+        cycles: Number of cycles (capped at Config.PROFILE_MAX_CYCLES)
+        requested_by: Dashboard user, shown with the status
+    """
+    arm_state = {
+        'remaining': max(1, min(int(cycles), Config.PROFILE_MAX_CYCLES)),
+        'armed_at': datetime.utcnow().isoformat(),
+        'requested_by': requested_by
+    }
+    with _arm_lock:
+        _write_arm(arm_state)
+    return arm_state
+
+
+def disarm():
+    """Cancel the cycles still to be profiled"""
+    with _arm_lock:
+        Config.PROFILE_ARM_PATH.unlink(missing_ok=True)
+
+
+def status() -> Optional[Dict]:
+    """Arm state ('remaining' cycles etc.), or None when not armed"""
+    return _read_arm()
+
+
+def _take_cycle() -> bool:
+    """Whether this cycle is to be profiled (counts it off the arm file)"""
+    # Cheap check first: the file is absent almost always
+    if not Config.PROFILE_ARM_PATH.exists():
+        return False
+    with _arm_lock:
+        arm_state = _read_arm()
+        if not arm_state or arm_state.get('remaining', 0) < 1:
+            Config.PROFILE_ARM_PATH.unlink(missing_ok=True)
+            return False
+        arm_state['remaining'] -= 1
+        if arm_state['remaining'] > 0:
+            _write_arm(arm_state)
+        else:
+            Config.PROFILE_ARM_PATH.unlink(missing_ok=True)
+        return True
+
+
+class StackSampler:
+    """Counts the collapsed stacks of one thread, sampled at an interval"""
+    
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+    
+    def write(self, path: Path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile_cycle():
+    """Profile the enclosed sync cycle if the profiler is armed"""
+    try:
+        armed = _take_cycle()
+    except Exception as e:
+        logger.error(f"Error checking profiler arm file: {e}")
+        armed = False
+    if not armed:
+        yield
+        return
+    
+    profile = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident(), Config.PROFILE_SAMPLE_INTERVAL)
+    name = f"cycle-{datetime.utcnow():%Y%m%d-%H%M%S}-{os.getpid()}"
+    started = time.perf_counter()
+    try:
+        profile.enable()
+    except ValueError as e:  # another profiler is active in this thread
+        logger.error(f"Could not profile sync cycle: {e}")
+        yield
+        return
+    sampler.start()
+    try:
+        yield
+    finally:
+        profile.disable()
+        sampler.stop()
+        try:
+            Config.PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+            profile.dump_stats(str(Config.PROFILES_DIR / f"{name}{PSTATS_SUFFIX}"))
+            sampler.write(Config.PROFILES_DIR / f"{name}{COLLAPSED_SUFFIX}")
+            logger.info(f"Profiled sync cycle {name} ({time.perf_counter() - started:.1f}s)")
+            prune(Config.PROFILE_KEEP)
+        except Exception as e:
+            logger.error(f"Error saving profile {name}: {e}")
+
+
+def list_profiles() -> List[Dict]:
+    """Saved profiles, newest first"""
+    profiles = []
+    for path in Config.PROFILES_DIR.glob(f"*{PSTATS_SUFFIX}"):
+        name = path.name[:-len(PSTATS_SUFFIX)]
+        collapsed = path.with_name(f"{name}{COLLAPSED_SUFFIX}")
+        stat = path.stat()
+        profiles.append({
+            'name': name,
+            'created_at': datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+            'pstats': path.name,
+            'pstats_size': stat.st_size,
+            'collapsed': collapsed.name if collapsed.exists() else None,
+            'collapsed_size': collapsed.stat().st_size if collapsed.exists() else 0
+        })
+    profiles.sort(key=lambda profile: profile['created_at'], reverse=True)
+    return profiles
+
+
+def prune(keep: int) -> int:
+    """Delete all but the newest keep profiles; returns the number deleted"""
+    removed = 0
+    for profile in list_profiles()[keep:]:
+        (Config.PROFILES_DIR / profile['pstats']).unlink(missing_ok=True)
+        if profile['collapsed']:
+            (Config.PROFILES_DIR / profile['collapsed']).unlink(missing_ok=True)
+        removed += 1
+    return removed
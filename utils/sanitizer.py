@@ -2,7 +2,8 @@
 Data sanitization utilities for protecting sensitive information
 """
 import re
-from typing import Any, Dict, List
+from functools import lru_cache
+from typing import Any, Dict
 
 class DataSanitizer:
     """Sanitize sensitive data from logs and displays"""
@@ -13,12 +14,19 @@ class DataSanitizer:
         'x-api-key', 'x-ca-key', 'x-ca-signature', 'api_key', 'app_secret'
     ]
     
-    SENSITIVE_PATTERNS = [
-        (r'\d{10}', '***IDNUM***'),  # National ID numbers (10 digits)
-        (r'\d{14}', '***IDNUM***'),  # Extended ID numbers (14 digits)
-        (r'05\d{8}', '***PHONE***'),  # Saudi phone numbers
-        (r'\+9665\d{8}', '***PHONE***'),  # Saudi phone numbers with country code
-    ]
+    # One compiled pass over each string: Saudi phone numbers (with or without
+    # country code), otherwise any run of 10+ digits (national / extended ID
+    # numbers) is masked as a whole
+    SENSITIVE_PATTERN = re.compile(
+        r'(?P<phone>\+9665\d{8}(?!\d)|(?<!\d)05\d{8}(?!\d))|\d{10,}'
+    )
+    
+    # Keys holding base64 images, replaced by a placeholder without scanning them
+    IMAGE_KEYS = frozenset(['faceData', 'imageData', 'cardImage'])
+    IMAGE_MIN_LENGTH = 100
+    
+    # sanitize_payload truncates longer strings before pattern matching
+    MAX_STRING_LENGTH = 64 * 1024
     
     @staticmethod
     def sanitize(data: Any, depth: int = 0) -> Any:
@@ -32,56 +40,64 @@ class DataSanitizer:
         Returns:
             Sanitized data
         """
+        return DataSanitizer._walk(data, depth, False)
+    
+    @staticmethod
+    def sanitize_payload(data: Any, max_string_length: int = None) -> Any:
+        """
+        Sanitize a request/response body and redact base64 images in one pass
+        
+        Same result as sanitize_body followed by redact_base64_images, but
+        each value is visited once and images are never pattern-matched.
+        Strings are truncated to max_string_length (default MAX_STRING_LENGTH).
+        """
+        return DataSanitizer._walk(data, 0, True, max_string_length or DataSanitizer.MAX_STRING_LENGTH)
+    
+    @staticmethod
+    def _walk(data: Any, depth: int, redact_images: bool, max_string_length: int = None) -> Any:
         if depth > 10:  # Prevent infinite recursion
             return '[MAX_DEPTH_REACHED]'
         
-        if isinstance(data, dict):
-            return DataSanitizer._sanitize_dict(data, depth)
+        if isinstance(data, str):
+            return DataSanitizer._sanitize_string(data, max_string_length)
+        elif isinstance(data, dict):
+            return DataSanitizer._sanitize_dict(data, depth, redact_images, max_string_length)
         elif isinstance(data, list):
-            return DataSanitizer._sanitize_list(data, depth)
-        elif isinstance(data, str):
-            return DataSanitizer._sanitize_string(data)
+            return [DataSanitizer._walk(item, depth + 1, redact_images, max_string_length) for item in data]
         else:
             return data
     
     @staticmethod
-    def _sanitize_dict(data: Dict, depth: int) -> Dict:
+    def _sanitize_dict(data: Dict, depth: int, redact_images: bool = False, max_string_length: int = None) -> Dict:
         """Sanitize dictionary"""
         sanitized = {}
         
         for key, value in data.items():
-            # Check if key is sensitive
-            is_sensitive = any(
-                sensitive.lower() in key.lower()
-                for sensitive in DataSanitizer.SENSITIVE_KEYS
-            )
-            
-            if is_sensitive:
+            if _is_sensitive_key(key):
                 # Completely redact sensitive values
-                if isinstance(value, str) and value:
-                    sanitized[key] = '***REDACTED***'
-                else:
-                    sanitized[key] = '***REDACTED***'
+                sanitized[key] = '***REDACTED***'
+            elif (
+                redact_images and key in DataSanitizer.IMAGE_KEYS and isinstance(value, str)
+                and len(value) > DataSanitizer.IMAGE_MIN_LENGTH
+            ):
+                sanitized[key] = f'[BASE64_IMAGE_{len(value)}_BYTES]'
             else:
                 # Recursively sanitize nested structures
-                sanitized[key] = DataSanitizer.sanitize(value, depth + 1)
+                sanitized[key] = DataSanitizer._walk(value, depth + 1, redact_images, max_string_length)
         
         return sanitized
     
     @staticmethod
-    def _sanitize_list(data: List, depth: int) -> List:
-        """Sanitize list"""
-        return [DataSanitizer.sanitize(item, depth + 1) for item in data]
-    
-    @staticmethod
-    def _sanitize_string(data: str) -> str:
-        """Sanitize string by replacing sensitive patterns"""
-        result = data
+    def _sanitize_string(data: str, max_string_length: int = None) -> str:
+        """Sanitize string by replacing sensitive patterns (truncated beyond max_string_length, if given)"""
+        if len(data) < 10:  # too short for any pattern
+            return data
         
-        for pattern, replacement in DataSanitizer.SENSITIVE_PATTERNS:
-            result = re.sub(pattern, replacement, result)
+        if max_string_length and len(data) > max_string_length:
+            data = data[:max_string_length]
+            return DataSanitizer.SENSITIVE_PATTERN.sub(_replacement, data) + '...[TRUNCATED]'
         
-        return result
+        return DataSanitizer.SENSITIVE_PATTERN.sub(_replacement, data)
     
     @staticmethod
     def sanitize_headers(headers: Dict) -> Dict:
@@ -99,9 +115,9 @@ class DataSanitizer:
         if isinstance(data, dict):
             result = {}
             for key, value in data.items():
-                if key in ['faceData', 'imageData', 'cardImage'] and isinstance(value, str):
+                if key in DataSanitizer.IMAGE_KEYS and isinstance(value, str):
                     # Check if it looks like base64
-                    if len(value) > 100:
+                    if len(value) > DataSanitizer.IMAGE_MIN_LENGTH:
                         result[key] = f'[BASE64_IMAGE_{len(value)}_BYTES]'
                     else:
                         result[key] = value
@@ -114,3 +130,14 @@ class DataSanitizer:
             return [DataSanitizer.redact_base64_images(item) for item in data]
         else:
             return data
+
+
+def _replacement(match: re.Match) -> str:
+    return '***PHONE***' if match.group('phone') else '***IDNUM***'
+
+
+@lru_cache(maxsize=4096)
+def _is_sensitive_key(key: Any) -> bool:
+    """Whether a dict key names a secret (memoized: payloads reuse the same keys)"""
+    key = str(key).lower()
+    return any(sensitive in key for sensitive in DataSanitizer.SENSITIVE_KEYS)
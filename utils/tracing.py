@@ -0,0 +1,215 @@
+"""
+Stage tracing of processed events
+
+process_single_event opens a trace per event; the stages inside it
+(downloads, face encoding, duplicate scan, API calls, database writes)
+open spans, tagged with the worker's national ID. The current trace
+follows the call stack through a context variable, so span() is a no-op
+outside of an event. Finished traces go to a ring buffer that the
+dashboard shows as per-event waterfalls and per-stage breakdowns.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import Config
+
+
+class Trace:
+    """Spans of one event"""
+    
+    def __init__(self, event_id: str, event_type: str):
+        self.event_id = event_id
+        self.event_type = event_type
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.national_ids: List[str] = []
+        self.national_id: Optional[str] = None  # of the innermost open span
+        self.depth = 0
+        self.error: Optional[str] = None
+    
+    def to_dict(self, end: float) -> Dict:
+        return {
+            'event_id': self.event_id,
+            'event_type': self.event_type,
+            'started_at': self.started_at.isoformat(),
+            'duration_ms': round((end - self.start) * 1000, 2),
+            'national_ids': self.national_ids,
+            'error': self.error,
+            'spans': self.spans
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+
+
+class TraceBuffer:
+    """The last finished traces, oldest first"""
+    
+    def __init__(self, size: int):
+        self.lock = threading.Lock()
+        self.traces = deque(maxlen=size)
+    
+    def add(self, trace: Dict):
+        with self.lock:
+            self.traces.append(trace)
+    
+    def list(self) -> List[Dict]:
+        with self.lock:
+            return list(self.traces)
+    
+    def write_snapshot(self, path: Path):
+        """Write the buffered traces atomically (for a dashboard in another process)"""
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(self.list()))
+        os.replace(tmp_path, path)
+    
+    @staticmethod
+    def read_snapshot(path: Path) -> List[Dict]:
+        try:
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            print(f"Error reading traces snapshot: {e}")
+            return []
+
+
+buffer = TraceBuffer(Config.TRACE_BUFFER_SIZE)
+
+
+@contextmanager
+def trace_event(event_id: str, event_type: str):
+    """Trace the processing of one event into the buffer"""
+    if not Config.TRACE_ENABLED:
+        yield None
+        return
+    
+    trace = Trace(event_id, event_type)
+    token = _current.set(trace)
+    try:
+        yield trace
+    except BaseException as e:
+        trace.error = str(e) or type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        buffer.add(trace.to_dict(time.perf_counter()))
+
+
+@contextmanager
+def span(name: str, national_id: Optional[str] = None, **tags):
+    """
+    Time a stage of the current event (nothing when no event is traced)
+    
+    Args:
+        name: Stage name, e.g. 'face_encode' or 'hikcentral.request'
+        national_id: Worker the stage belongs to (default: the enclosing span's)
+        **tags: Extra details shown with the span (e.g. the endpoint)
+    """
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    
+    national_id = national_id or trace.national_id
+    if national_id and national_id not in trace.national_ids:
+        trace.national_ids.append(national_id)
+    record = {
+        'name': name,
+        'start_ms': round((time.perf_counter() - trace.start) * 1000, 2),
+        'duration_ms': None,
+        'depth': trace.depth,
+        'national_id': national_id,
+        'tags': tags,
+        'error': False
+    }
+    trace.spans.append(record)
+    parent_national_id = trace.national_id
+    trace.national_id = national_id
+    trace.depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record['error'] = True
+        raise
+    finally:
+        record['duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        trace.depth -= 1
+        trace.national_id = parent_national_id
+
+
+def set_error(message: str):
+    """Mark the current event as failed (for errors handled inside it)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.error = message
+
+
+def recent_traces(limit: int = 50, event_type: Optional[str] = None, national_id: Optional[str] = None) -> List[Dict]:
+    """
+    Finished traces, newest first
+    
+    Read from this process's buffer when the dashboard runs in the sync
+    process, otherwise from the snapshot the sync service writes each cycle.
+    """
+    if Config.DASHBOARD_IN_PROCESS:
+        traces = buffer.list()
+    else:
+        traces = TraceBuffer.read_snapshot(Config.TRACES_SNAPSHOT_PATH)
+    
+    result = []
+    for trace in reversed(traces):
+        if event_type and trace['event_type'] != event_type:
+            continue
+        if national_id and national_id not in trace['national_ids']:
+            continue
+        result.append(trace)
+        if len(result) >= limit:
+            break
+    return result
+
+
+def stage_breakdown(traces: List[Dict]) -> List[Dict]:
+    """
+    Aggregate timings per stage over traces, slowest total first
+    
+    Returns:
+        Per stage: count, errors, total/avg/p95/max ms and its share of the
+        traced events' total time (nested stages count within their parents)
+    """
+    durations: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    total_ms = 0.0
+    for trace in traces:
+        total_ms += trace['duration_ms']
+        for record in trace['spans']:
+            if record['duration_ms'] is None:
+                continue
+            durations.setdefault(record['name'], []).append(record['duration_ms'])
+            errors[record['name']] = errors.get(record['name'], 0) + record['error']
+    
+    stages = []
+    for name, values in durations.items():
+        values.sort()
+        stage_total = sum(values)
+        stages.append({
+            'name': name,
+            'count': len(values),
+            'errors': errors[name],
+            'total_ms': round(stage_total, 2),
+            'avg_ms': round(stage_total / len(values), 2),
+            'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max_ms': values[-1],
+            'share': round(stage_total / total_ms * 100, 1) if total_ms else 0.0
+        })
+    stages.sort(key=lambda stage: stage['total_ms'], reverse=True)
+    return stages
@@ -0,0 +1,13 @@
+"""
+WSGI entry point to serve the dashboard in its own processes
+    
+    gunicorn -w 4 -b 0.0.0.0:8080 wsgi:app
+
+Set Config.DASHBOARD_IN_PROCESS = False so main.py doesn't serve it too.
+The data files are shared safely with the sync service (see utils/file_lock.py).
+"""
+from config import Config
+
+Config.ensure_directories()
+
+from dashboard.app import app  # noqa: E402